@@ -5,7 +5,12 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
+import babel.dates
+import functools
+import hashlib
+import asyncio
+import io
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, stream_with_context, make_response, send_file
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
@@ -13,8 +18,32 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+from search import SearchEngine
+from facets import FacetIndex
+from matching import CandidatePool, Matchmaker
+from schedule import IntervalIndex, ScheduleChecker, show_end
+from cache import create_cache, DataVersion, PageCache
+from lookups import LookupCache, insert_ignore, register_session_events
+from instrumentation import QueryInstrumentation
+from routing import ReplicaRouter, RoutingSession
+from tasks import TaskQueue
+from images import DiskCache, ImageError, ImageProxy, fetch_image
 import datetime
 import itertools
+import collections
+import time
+import click
+import threading
+import urllib.error
+import urllib.request
+import importer
+import links
+import benchmark
+import exporter
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -22,8 +51,25 @@ import itertools
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 migrate = Migrate(app, db)
+detail_cache = create_cache(app.config)
+instrumentation = QueryInstrumentation(app)
+data_version = DataVersion(db)
+data_version.watch(db.session)
+page_cache = PageCache(create_cache(app.config), data_version,
+                       enabled=app.config.get('PAGE_CACHE', False),
+                       max_age=app.config.get('PAGE_CACHE_MAX_AGE', 30))
+app.jinja_env.globals['cache_fragment'] = page_cache.fragment
+replica_router = ReplicaRouter(
+    app, read_endpoints=('search_venues', 'search_artists'),
+    last_write=lambda: data_version.changed_at)
+tasks = TaskQueue(app)
+image_proxy = ImageProxy(
+    DiskCache(app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_CACHE_MAX_BYTES']),
+    fetch=functools.partial(fetch_image, timeout=app.config['IMAGE_FETCH_TIMEOUT'],
+                            max_bytes=app.config['IMAGE_MAX_SOURCE_BYTES']))
+links.allowed_hosts = frozenset(app.config['LINK_ALLOWED_HOSTS'])
 
 # TODO: connect to a local postgresql database
 
@@ -35,14 +81,20 @@ VenueGenres = db.Table('venue_genres',
                        db.Column('venue_id', db.Integer,
                                  db.ForeignKey('venues.id')),
                        db.Column('genre_id', db.Integer,
-                                 db.ForeignKey('genres.id'))
+                                 db.ForeignKey('genres.id')),
+                       db.Index('ix_venue_genres_venue_id_genre_id',
+                                'venue_id', 'genre_id'),
+                       db.Index('ix_venue_genres_genre_id', 'genre_id')
                        )
 
 ArtistGenres = db.Table('artist_genres',
                         db.Column('artist_id', db.Integer,
                                   db.ForeignKey('artists.id')),
                         db.Column('genre_id', db.Integer,
-                                  db.ForeignKey('genres.id'))
+                                  db.ForeignKey('genres.id')),
+                        db.Index('ix_artist_genres_artist_id_genre_id',
+                                 'artist_id', 'genre_id'),
+                        db.Index('ix_artist_genres_genre_id', 'genre_id')
                         )
 
 
@@ -50,7 +102,7 @@ class Genres(db.Model):
     __tablename__ = 'genres'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120))
+    name = db.Column(db.String(120), unique=True)
 
     def __repr__(self):
         return self.name
@@ -58,6 +110,7 @@ class Genres(db.Model):
 
 class City(db.Model):
     __tablename__ = 'cities'
+    __table_args__ = (db.UniqueConstraint('name', 'state_id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -73,7 +126,7 @@ class State(db.Model):
     __tablename__ = 'states'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, unique=True)
     cities = db.relationship("City", backref='state', lazy=True)
 
     def __repr__(self):
@@ -93,9 +146,10 @@ class Venue(db.Model):
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     shows = db.relationship("Show", backref='venue', lazy=True)
-    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'))
+    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), index=True)
     genres = db.relationship(
         'Genres', secondary=VenueGenres, backref='venues', lazy=True)
+    search_text = db.Column(db.String)
 
     def __repr__(self):
         return "<Venue (name='%s')>" % (self.name)
@@ -113,19 +167,38 @@ class Artist(db.Model):
     seeking_description = db.Column(db.String)
     website = db.Column(db.String(120))
     shows = db.relationship("Show", backref='artist', lazy=True)
-    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'))
+    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), index=True)
     genres = db.relationship(
         'Genres', secondary=ArtistGenres, backref='artists', lazy=True)
+    search_text = db.Column(db.String)
 
     def __repr__(self):
         return "<Artist(name='%s')>" % self.name
 
 
+SHOW_DURATION = 120
+
+
 class Show(db.Model):
     __tablename__ = 'shows'
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+        # Rejects double bookings of a venue, however they are written; the
+        # expression matches ScheduleChecker.booked_range
+        ExcludeConstraint(
+            ('venue_id', '='),
+            (db.literal_column('tsrange(start_time, start_time + make_interval(mins => duration))'),
+             '&&'),
+            name='shows_no_overlap', using='gist').ddl_if(dialect='postgresql'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime(), nullable=False)
+    # Minutes the venue is booked for, from start_time
+    duration = db.Column(db.Integer, nullable=False,
+                         default=SHOW_DURATION, server_default=str(SHOW_DURATION))
     venue_id = db.Column(db.Integer, db.ForeignKey(
         'venues.id'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey(
@@ -134,28 +207,415 @@ class Show(db.Model):
     def __repr__(self):
         return "<Show (start_time='%s')>" % format_datetime(self.start_time)
 
+
+event.listen(Show.__table__, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+
+
+class ShowSummary(db.Model):
+    """Denormalized copy of a show with the venue and artist columns that
+    listings render, so they read a single table."""
+    __tablename__ = 'show_summaries'
+    __table_args__ = (
+        db.Index('ix_show_summaries_start_time_id', 'start_time', 'id'),
+        db.Index('ix_show_summaries_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_summaries_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_summaries_venue_city_id_start_time', 'venue_city_id', 'start_time'),
+    )
+
+    id = db.Column(db.Integer, db.ForeignKey(
+        'shows.id', ondelete='CASCADE'), primary_key=True)
+    start_time = db.Column(db.DateTime(), nullable=False)
+    duration = db.Column(db.Integer)
+    venue_id = db.Column(db.Integer, nullable=False)
+    venue_city_id = db.Column(db.Integer)
+    venue_name = db.Column(db.String)
+    venue_image_link = db.Column(db.String(500))
+    artist_id = db.Column(db.Integer, nullable=False)
+    artist_name = db.Column(db.String)
+    artist_image_link = db.Column(db.String(500))
+
+    def __repr__(self):
+        return "<ShowSummary (id=%s)>" % self.id
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_PAGE_MAX = 200
+
+venue_search = SearchEngine(db, Venue, Venue.search_text, data_version.current)
+artist_search = SearchEngine(db, Artist, Artist.search_text, data_version.current)
+
+
+def searchDocument(entity):
+    parts = [entity.name]
+    if entity.city is not None:
+        parts.append(entity.city.name)
+        if entity.city.state is not None:
+            parts.append(entity.city.state.name)
+    parts.extend(genre.name for genre in entity.genres)
+    return ' '.join(part for part in parts if part)
+
+
+def setSearchText(mapper, connection, target):
+    target.search_text = searchDocument(target)
+
+
+def indexSearchText(mapper, connection, target):
+    data_version.stage(object_session(target), search_engines[type(target)].update,
+                       target.id, target.search_text)
+
+
+def unindexSearchText(mapper, connection, target):
+    data_version.stage(object_session(target), search_engines[type(target)].remove, target.id)
+
+
+search_engines = {Venue: venue_search, Artist: artist_search}
+for model in search_engines:
+    event.listen(model, 'before_insert', setSearchText)
+    event.listen(model, 'before_update', setSearchText)
+    event.listen(model, 'after_insert', indexSearchText)
+    event.listen(model, 'after_update', indexSearchText)
+    event.listen(model, 'after_delete', unindexSearchText)
+
+#----------------------------------------------------------------------------#
+# Discovery.
+#----------------------------------------------------------------------------#
+
+venue_facets = FacetIndex(db, Venue, VenueGenres, VenueGenres.c.venue_id, Genres,
+                          Venue.seeking_talent, data_version.current)
+artist_facets = FacetIndex(db, Artist, ArtistGenres, ArtistGenres.c.artist_id, Genres,
+                           Artist.seeking_venue, data_version.current)
+
+
+def indexFacets(mapper, connection, target):
+    seeking = target.seeking_talent if isinstance(target, Venue) else target.seeking_venue
+    data_version.stage(object_session(target), facet_indexes[type(target)].update,
+                       target.id, [genre.name for genre in target.genres], target.city_id, seeking)
+
+
+def unindexFacets(mapper, connection, target):
+    data_version.stage(object_session(target), facet_indexes[type(target)].remove, target.id)
+
+
+facet_indexes = {Venue: venue_facets, Artist: artist_facets}
+for model in facet_indexes:
+    event.listen(model, 'after_insert', indexFacets)
+    event.listen(model, 'after_update', indexFacets)
+    event.listen(model, 'after_delete', unindexFacets)
+
+
+def parseFacetFilters(args):
+    """Reads the genre (repeatable), match (all or any), city and seeking
+    filters. Returns FacetIndex.ids arguments, or None when none is set."""
+    filters = {
+        'genres': [genre for genre in args.getlist('genre') if genre],
+        'match_all': args.get('match', 'all') != 'any',
+        'city_id': args.get('city', type=int),
+        'seeking': bool(args.get('seeking'))
+    }
+    if not filters['genres'] and filters['city_id'] is None and not filters['seeking']:
+        return None
+    return filters
+
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#----------------------------------------------------------------------------#
+
+MATCH_LIMIT = 10
+MATCH_LIMIT_MAX = 50
+
+
+def matchPoolLoader(model, genres_column, seeking_column, show_column):
+    def load(version):
+        rows = db.session.query(model.id, model.city_id, City.state_id, seeking_column).outerjoin(
+            City, model.city_id == City.id).order_by(model.id).all()
+        genre_pairs = db.session.query(genres_column, genres_column.table.c.genre_id).all()
+        show_counts = dict(db.session.query(show_column, db.func.count()).group_by(show_column).all())
+        return CandidatePool(rows, genre_pairs, show_counts, version)
+    return load
+
+
+def loadMatchTarget(model, genres_column, own_show_column, show_column, target_id):
+    """Genres, city, state and per-candidate show counts of the entity
+    candidates are ranked for."""
+    row = db.session.query(model.city_id, City.state_id).outerjoin(
+        City, model.city_id == City.id).filter(model.id == target_id).first()
+    if row is None:
+        return None
+    genre_ids = [genre_id for genre_id, in db.session.query(
+        genres_column.table.c.genre_id).filter(genres_column == target_id)]
+    history = dict(db.session.query(show_column, db.func.count()).filter(
+        own_show_column == target_id).group_by(show_column).all())
+    return genre_ids, row.city_id, row.state_id, history
+
+
+artist_matches = Matchmaker('artists', matchPoolLoader(
+    Artist, ArtistGenres.c.artist_id, Artist.seeking_venue, Show.artist_id),
+    detail_cache, app.config.get('MATCH_POOL_MAX_STALE', 60))
+venue_matches = Matchmaker('venues', matchPoolLoader(
+    Venue, VenueGenres.c.venue_id, Venue.seeking_talent, Show.venue_id),
+    detail_cache, app.config.get('MATCH_POOL_MAX_STALE', 60))
+
+# Target kind: matchmaker, candidate model and target loader
+MATCH_KINDS = {
+    'venues': (artist_matches, Artist, lambda target_id: loadMatchTarget(
+        Venue, VenueGenres.c.venue_id, Show.venue_id, Show.artist_id, target_id)),
+    'artists': (venue_matches, Venue, lambda target_id: loadMatchTarget(
+        Artist, ArtistGenres.c.artist_id, Show.artist_id, Show.venue_id, target_id)),
+}
+
+
+def recommendMatches(kind, target_id, limit=MATCH_LIMIT):
+    """Ranks artists for a venue (kind 'venues') or venues for an artist.
+    Returns a list of candidate dicts with their scores, or None when the
+    target does not exist."""
+    matchmaker, candidate, load_target = MATCH_KINDS[kind]
+    matches = matchmaker.recommend(target_id, lambda: load_target(target_id),
+                                   data_version.current(), limit)
+    if matches is None:
+        return None
+    found = {row.id: row for row in db.session.query(
+        candidate.id, candidate.name, candidate.image_link).filter(
+        candidate.id.in_([candidate_id for candidate_id, _ in matches]))}
+    return [{'id': candidate_id, 'name': found[candidate_id].name,
+             'image_link': found[candidate_id].image_link, 'score': round(score, 4)}
+            for candidate_id, score in matches if candidate_id in found]
+
+#----------------------------------------------------------------------------#
+# Read models.
+#----------------------------------------------------------------------------#
+
+SUMMARY_COLUMNS = ['id', 'start_time', 'duration', 'venue_id', 'venue_city_id', 'venue_name',
+                   'venue_image_link', 'artist_id', 'artist_name', 'artist_image_link']
+
+
+def showSummarySelect():
+    return db.select(Show.id, Show.start_time, Show.duration, Show.venue_id, Venue.city_id,
+                     Venue.name, Venue.image_link,
+                     Show.artist_id, Artist.name, Artist.image_link).join(
+        Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id)
+
+
+def insertShowSummaries(connection, condition):
+    connection.execute(ShowSummary.__table__.insert().from_select(
+        SUMMARY_COLUMNS, showSummarySelect().where(condition)))
+
+
+def syncShowSummary(mapper, connection, target):
+    summaries = ShowSummary.__table__
+    connection.execute(summaries.delete().where(summaries.c.id == target.id))
+    insertShowSummaries(connection, Show.id == target.id)
+
+
+def dropShowSummary(mapper, connection, target):
+    summaries = ShowSummary.__table__
+    connection.execute(summaries.delete().where(summaries.c.id == target.id))
+
+
+def syncSummaryNames(mapper, connection, target):
+    prefix = 'venue' if isinstance(target, Venue) else 'artist'
+    values = {
+        prefix + '_name': target.name,
+        prefix + '_image_link': target.image_link
+    }
+    if prefix == 'venue':
+        values['venue_city_id'] = target.city_id
+    summaries = ShowSummary.__table__
+    connection.execute(summaries.update().where(
+        summaries.c[prefix + '_id'] == target.id).values(values))
+
+
+event.listen(Show, 'after_insert', syncShowSummary)
+event.listen(Show, 'after_update', syncShowSummary)
+event.listen(Show, 'before_delete', dropShowSummary)
+event.listen(Venue, 'after_update', syncSummaryNames)
+event.listen(Artist, 'after_update', syncSummaryNames)
+
+
+def refreshShowSummaries(full=False):
+    """Brings show_summaries up to date with shows written outside the ORM
+    (bulk imports): inserts missing rows and drops orphans. `full` rebuilds
+    the table from scratch. Returns (inserted, deleted)."""
+    summaries = ShowSummary.__table__
+    connection = db.session.connection()
+    if full:
+        deleted = connection.execute(summaries.delete()).rowcount
+        inserted = connection.execute(summaries.insert().from_select(
+            SUMMARY_COLUMNS, showSummarySelect())).rowcount
+    else:
+        deleted = connection.execute(summaries.delete().where(~db.exists().where(
+            Show.id == summaries.c.id))).rowcount
+        inserted = connection.execute(summaries.insert().from_select(
+            SUMMARY_COLUMNS, showSummarySelect().where(~db.exists().where(
+                summaries.c.id == Show.id)))).rowcount
+    if inserted or deleted:
+        # Bumps the data version in this transaction, so cached pages and
+        # indexes never outlive the rows they were built from
+        data_version.touch(db.session)
+    db.session.commit()
+    return inserted, deleted
+
+
+def checkShowSummaries():
+    """Compares show_summaries with the normalized tables and returns the
+    ids of missing, orphaned and stale summary rows."""
+    summaries = ShowSummary.__table__
+    missing = [row[0] for row in db.session.query(Show.id).filter(
+        ~db.exists().where(summaries.c.id == Show.id))]
+    orphaned = [row[0] for row in db.session.query(summaries.c.id).filter(
+        ~db.exists().where(Show.id == summaries.c.id))]
+    source = showSummarySelect().subquery()
+    stale = [row[0] for row in db.session.query(summaries.c.id).join(
+        source, source.c.id == summaries.c.id).filter(db.or_(
+            *[summaries.c[name].is_distinct_from(column)
+              for name, column in zip(SUMMARY_COLUMNS[1:], list(source.c)[1:])]))]
+    return {'missing': missing, 'orphaned': orphaned, 'stale': stale}
+
+#----------------------------------------------------------------------------#
+# Scheduling.
+#----------------------------------------------------------------------------#
+
+schedule = ScheduleChecker(db, Show, data_version.current)
+artist_schedule = ScheduleChecker(db, Show, data_version.current, Show.artist_id)
+
+
+def stageSchedule(session, show_id, venue_id, artist_id, start_time, duration):
+    data_version.stage(session, schedule.update, show_id, venue_id, start_time, duration)
+    data_version.stage(session, artist_schedule.update, show_id, artist_id, start_time, duration)
+
+
+def scheduleShow(mapper, connection, target):
+    stageSchedule(object_session(target), target.id, target.venue_id, target.artist_id,
+                  target.start_time, target.duration)
+
+
+def unscheduleShow(mapper, connection, target):
+    data_version.stage(object_session(target), schedule.remove, target.id, target.venue_id)
+    data_version.stage(object_session(target), artist_schedule.remove, target.id, target.artist_id)
+
+
+event.listen(Show, 'after_insert', scheduleShow)
+event.listen(Show, 'after_update', scheduleShow)
+event.listen(Show, 'after_delete', unscheduleShow)
+
+
+BOOKING_CONFLICT = 'Venue was booked for that time in the meantime. Show could not be listed.'
+
+
+def describeConflicts(show_ids):
+    shows = db.session.query(Show.id, Show.start_time, Show.duration).filter(
+        Show.id.in_(show_ids)).order_by(Show.start_time).all()
+    return ', '.join('show %d (%s to %s)' % (
+        show.id, format_datetime(show.start_time),
+        format_datetime(show_end(show.start_time, show.duration))) for show in shows)
+
+#----------------------------------------------------------------------------#
+# Background tasks.
+#----------------------------------------------------------------------------#
+
+LINK_CHECK_TIMEOUT = 5
+
+
+@tasks.task
+def dropCounterpartPages(kind, entity_id):
+    """Drops the cached detail pages listing shows of an edited venue or
+    artist; its own page is dropped inline by the handler."""
+    keys = venueDetailKeys(entity_id) if kind == 'venues' else artistDetailKeys(entity_id)
+    detail_cache.delete(*keys[1:])
+
+
+@tasks.task
+def checkLinks(kind, entity_id):
+    """Logs links of a venue or artist that answer with an error or lead to
+    a non-public address. Network failures raise, so the job is retried
+    with backoff."""
+    if not app.config['LINK_CHECKS']:
+        return
+    model = Venue if kind == 'venues' else Artist
+    item = db.session.get(model, entity_id)
+    if item is None:
+        return
+    for field in ('image_link', 'website', 'facebook_link'):
+        url = getattr(item, field)
+        if not url or not url.startswith(('http://', 'https://')):
+            continue
+        if field == 'image_link' and app.config['IMAGE_PROXY']:
+            # Also renders the thumbnails, so the first page view finds them
+            try:
+                image_proxy.warm(url)
+            except ImageError as err:
+                app.logger.warning('%s %d image_link %s is unusable: %s', kind, entity_id, url, err)
+            continue
+        try:
+            links.urlopen(urllib.request.Request(url, method='HEAD'),
+                          timeout=LINK_CHECK_TIMEOUT).close()
+        except urllib.error.HTTPError as err:
+            app.logger.warning('%s %d %s %s answers %d', kind, entity_id, field, url, err.code)
+        except links.UnsafeLinkError as err:
+            app.logger.warning('%s %d %s %s is not checked: %s', kind, entity_id, field, url, err)
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
+def parseStartTime(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
+
+
+@functools.lru_cache(maxsize=64)
+def datetimePattern(format, locale):
+    return (babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)),
+            babel.Locale.parse(locale))
+
+
+@functools.lru_cache(maxsize=4096)
+def formatTimestamp(value, format, locale):
+    """Formats a datetime or ISO string; memoized because listings repeat
+    the same few start times on every render."""
+    if isinstance(value, str):
+        value = parseStartTime(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    pattern, locale = datetimePattern(format, locale)
+    return pattern.apply(value, locale)
+
+
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+    return formatTimestamp(value, format, locale)
 
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+
+def thumbnail_url(url, size='tile'):
+    """Points an image link at the thumbnail proxy when it is enabled."""
+    if not url or not app.config['IMAGE_PROXY'] or not url.startswith(('http://', 'https://')):
+        return url
+    return url_for('image_thumbnail', size=size, url=url)
+
+
+app.jinja_env.filters['thumbnail'] = thumbnail_url
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 
 @app.route('/')
+@page_cache.page
 def index():
     return render_template('pages/home.html')
 
@@ -163,110 +623,206 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-def getVenueUpcomingShows(venue):
-    upcoming_shows = []
-    shows = Show.query.filter(Show.venue_id == venue.id).all()
+def getShowsTimeline(column, entity_id, counterpart, session=None):
+    """Loads every show summary matching `column == entity_id` from the
+    single show_summaries table and partitions them into upcoming and past
+    shows, described by their `counterpart` ('artist' or 'venue')."""
+    shows = (session or db.session).query(ShowSummary).filter(
+        column == entity_id).order_by(ShowSummary.start_time).all()
     now = datetime.datetime.now().replace(microsecond=0)
 
+    upcoming_shows = []
+    past_shows = []
     for show in shows:
+        item = {
+            counterpart + '_id': getattr(show, counterpart + '_id'),
+            counterpart + '_name': getattr(show, counterpart + '_name'),
+            counterpart + '_image_link': getattr(show, counterpart + '_image_link'),
+            'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
+        }
         if show.start_time >= now:
-            upcoming_shows.append(
-                {
-                    'artist_id': show.artist.id,
-                    'artist_name': show.artist.name,
-                    'artist_image_link': show.artist.image_link,
-                    'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-                }
-            )
-    return upcoming_shows
-
-
-def getVenuePastShows(venue):
-    past_shows = []
-    shows = Show.query.filter(Show.venue_id == venue.id).all()
-    now = datetime.datetime.now().replace(microsecond=0)
+            upcoming_shows.append(item)
+        else:
+            past_shows.append(item)
+
+    return {
+        'upcoming_shows': upcoming_shows,
+        'upcoming_shows_count': len(upcoming_shows),
+        'past_shows': past_shows,
+        'past_shows_count': len(past_shows)
+    }
 
-    for show in shows:
-        if show.start_time < now:
-            past_shows.append(
-                {
-                    'artist_id': show.artist.id,
-                    'artist_name': show.artist.name,
-                    'artist_image_link': show.artist.image_link,
-                    'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-                }
-            )
-    return past_shows
-
-
-def getArtistUpcomingShows(artist):
-    upcoming_shows = []
-    shows = Show.query.filter(Show.artist_id == artist.id).all()
-    now = datetime.datetime.now().replace(microsecond=0)
 
-    for show in shows:
-        if show.start_time >= now:
-            upcoming_shows.append(
-                {
-                    'venue_id': show.venue.id,
-                    'venue_name': show.venue.name,
-                    'venue_image_link': show.venue.image_link,
-                    'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-                }
-            )
-    return upcoming_shows
-
-
-def getArtistPastShows(artist):
-    past_shows = []
-    shows = Show.query.filter(Show.artist_id == artist.id).all()
-    now = datetime.datetime.now().replace(microsecond=0)
+def getEntityFields(session, model, entity_id, fields):
+    row = session.query(model, City.name, State.name).outerjoin(
+        City, model.city_id == City.id).outerjoin(
+        State, City.state_id == State.id).filter(model.id == entity_id).first()
+    if row is None:
+        return None
+    entity, city, state = row
+    data = {field: getattr(entity, field) for field in fields}
+    data['city'] = city
+    data['state'] = state
+    return data
+
+
+def getGenreNames(session, column, entity_id):
+    return [row[0] for row in session.query(Genres.name).join(
+        column.table, column.table.c.genre_id == Genres.id).filter(column == entity_id)]
+
+
+async def runQueries(**loaders):
+    """Runs independent loaders concurrently. Each gets a worker thread and
+    its own session (and so its own pooled connection); loaders must return
+    plain data, not ORM objects."""
+    engine = replica_router.read_engine() or db.engine
+
+    def run(loader):
+        with Session(engine) as session:
+            return loader(session)
+
+    names = list(loaders)
+    results = await asyncio.gather(
+        *[asyncio.to_thread(run, loaders[name]) for name in names])
+    return dict(zip(names, results))
+
+
+async def loadDetail(model, entity_id, fields, genres_column, shows_column, counterpart):
+    parts = await runQueries(
+        entity=lambda session: getEntityFields(session, model, entity_id, fields),
+        genres=lambda session: getGenreNames(session, genres_column, entity_id),
+        timeline=lambda session: getShowsTimeline(shows_column, entity_id, counterpart, session))
+    data = parts['entity']
+    if data is None:
+        return None
+    data['genres'] = parts['genres']
+    data.update(parts['timeline'])
+    return data
+
+
+async def readThroughDetail(key, load):
+    data = detail_cache.get(key)
+    if data is None:
+        data = await load()
+        if data is not None:
+            detail_cache.set(key, data)
+    return data
+
+
+state_ids = LookupCache('states')
+city_ids = LookupCache('cities')
+genre_ids = LookupCache('genres')
+register_session_events(db.session)
+
+
+def bulkGetOrInsertIds(cache, model, columns, keys):
+    """Resolves reference keys to ids with at most one INSERT and one SELECT
+    for everything missing from `cache`. Single column keys are plain
+    values, composite keys are tuples in `columns` order."""
+    cache.warm((row[0] if len(columns) == 1 else tuple(row[:-1]), row[-1])
+               for row in db.session.query(*columns, model.id).limit(cache.max_entries))
+    ids = {}
+    missing = []
+    for key in set(keys):
+        key_id = cache.get(key)
+        if key_id is None:
+            missing.append(key)
+        else:
+            ids[key] = key_id
+    if not missing:
+        return ids
+
+    names = [column.key for column in columns]
+    if len(columns) == 1:
+        rows = [{names[0]: key} for key in missing]
+        condition = columns[0].in_(missing)
+    else:
+        rows = [dict(zip(names, key)) for key in missing]
+        condition = db.tuple_(*columns).in_(missing)
+    insert_ignore(db.session, model.__table__, rows, names)
 
-    for show in shows:
-        if show.start_time < now:
-            past_shows.append(
-                {
-                    'venue_id': show.venue.id,
-                    'venue_name': show.venue.name,
-                    'venue_image_link': show.venue.image_link,
-                    'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-                }
-            )
-    return past_shows
+    for row in db.session.query(*columns, model.id).filter(condition):
+        key = row[0] if len(columns) == 1 else tuple(row[:-1])
+        ids[key] = row[-1]
+        cache.stage(db.session, key, row[-1])
+    return ids
 
 
 def getOrInsertState(value):
-    state_exist = State.query.filter(
-        State.name == value).first()
-    state = state_exist if state_exist is not None else State(
-        name=value)
-    return state
+    """Returns the id of the state named `value`, inserting it if missing."""
+    return bulkGetOrInsertIds(state_ids, State, [State.name], [value])[value]
 
 
-def getOrInsertCity(value, state):
-    city_exist = City.query.filter(
-        City.name == value, City.state_id == state.id).first()
-    city = city_exist if city_exist is not None else City(
-        name=value, state=state)
-    return city
+def getOrInsertCity(value, state_id):
+    key = (value, state_id)
+    city_id = bulkGetOrInsertIds(
+        city_ids, City, [City.name, City.state_id], [key])[key]
+    return db.session.get(City, city_id)
 
 
 def getOrInsertGenres(values):
-    genres = []
-    for item in values:
-        genres_exist = Genres.query.filter(Genres.name == item).first()
-        genres.append(
-            genres_exist if genres_exist is not None else Genres(name=item))
-    return genres
+    ids = bulkGetOrInsertIds(genre_ids, Genres, [Genres.name], values)
+    if not ids:
+        return []
+    genres = {item.id: item for item in Genres.query.filter(
+        Genres.id.in_(ids.values())).all()}
+    return [genres[ids[name]] for name in dict.fromkeys(values)]
+
+
+def clearLookupCaches():
+    for cache in (state_ids, city_ids, genre_ids):
+        cache.clear()
+
+
+def venueCacheKey(venue_id):
+    return 'venue:%s' % venue_id
+
+
+def artistCacheKey(artist_id):
+    return 'artist:%s' % artist_id
+
+
+def venueDetailKeys(venue_id):
+    """Cache keys to drop when a venue changes: its own page and the pages
+    of artists that list one of its shows."""
+    artist_ids = db.session.query(Show.artist_id).filter(
+        Show.venue_id == venue_id).distinct()
+    return [venueCacheKey(venue_id)] + [artistCacheKey(row[0]) for row in artist_ids]
+
+
+def artistDetailKeys(artist_id):
+    venue_ids = db.session.query(Show.venue_id).filter(
+        Show.artist_id == artist_id).distinct()
+    return [artistCacheKey(artist_id)] + [venueCacheKey(row[0]) for row in venue_ids]
 
 
 @app.route('/venues')
+@page_cache.page
 def venues():
+    now = datetime.datetime.now().replace(microsecond=0)
+    upcoming_counts = dict(
+        db.session.query(ShowSummary.venue_id, db.func.count(ShowSummary.id))
+        .filter(ShowSummary.start_time >= now)
+        .group_by(ShowSummary.venue_id)
+        .all())
+
+    filters = parseFacetFilters(request.args)
+    if filters is None:
+        cities = City.query.options(
+            db.joinedload(City.state), db.selectinload(City.venues)).all()
+        areas = [(item, item.venues) for item in cities]
+    else:
+        matched = Venue.query.options(
+            db.joinedload(Venue.city).joinedload(City.state)).filter(
+            Venue.id.in_(venue_facets.ids(**filters))).order_by(Venue.city_id, Venue.id).all()
+        areas = [(item, list(venues)) for item, venues in itertools.groupby(
+            matched, key=lambda venue: venue.city) if item is not None]
+
+    page_cache.prefetch('venue-item', [venue.id for _, venues in areas for venue in venues])
     data = []
-    for item in City.query.all():
-        venues = item.venues
+    for item, venues in areas:
         for venue in venues:
-            venue.upcoming_shows_count = len(getVenueUpcomingShows(venue))
+            venue.upcoming_shows_count = upcoming_counts.get(venue.id, 0)
 
         data.append({
             'city': item.name,
@@ -274,46 +830,35 @@ def venues():
             'venues': venues
         })
 
-    return render_template('pages/venues.html', areas=data)
+    return render_template('pages/venues.html', areas=data, filters=request.args,
+                           genres=Genres.query.order_by(Genres.name).all())
 
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
     search_term = request.form.get('search_term', '')
-    query = Venue.query.filter(Venue.name.ilike(f'%{search_term}%'))
+    limit = min(max(request.form.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_PAGE_MAX)
+    offset = max(request.form.get('offset', 0, type=int), 0)
+    filters = parseFacetFilters(request.form)
+    within = venue_facets.ids(**filters) if filters else None
+    count, data = venue_search.search(search_term, limit, offset, within)
     response = {
-        "count": query.count(),
-        "data": query.all()
+        "count": count,
+        "data": data
     }
     return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
+VENUE_DETAIL_FIELDS = ['id', 'name', 'facebook_link', 'website', 'image_link', 'address',
+                       'phone', 'seeking_talent', 'seeking_description']
+
+
 @app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
-    venue = Venue.query.get(venue_id)
-    upcomingShows = getVenueUpcomingShows(venue)
-    pastShows = getVenuePastShows(venue)
-    genres = []
-    for g in venue.genres:
-        genres.append(g.name)
-    data = {
-        'id': venue.id,
-        'name': venue.name,
-        'city': venue.city,
-        'state': venue.city.state,
-        'upcoming_shows_count': len(upcomingShows),
-        'upcoming_shows': upcomingShows,
-        'past_shows': pastShows,
-        'past_shows_count': len(pastShows),
-        'genres': genres,
-        'facebook_link': venue.facebook_link,
-        'website': venue.website,
-        'image_link': venue.image_link,
-        'address': venue.address,
-        'phone': venue.phone,
-        'seeking_talent': venue.seeking_talent,
-        'seeking_description': venue.seeking_description
-    }
+async def show_venue(venue_id):
+    data = await readThroughDetail(venueCacheKey(venue_id), lambda: loadDetail(
+        Venue, venue_id, VENUE_DETAIL_FIELDS, VenueGenres.c.venue_id, ShowSummary.venue_id, 'artist'))
+    if data is None:
+        abort(404)
 
     return render_template('pages/show_venue.html', venue=data)
 
@@ -331,20 +876,23 @@ def create_venue_form():
 def create_venue_submission():
     try:
         form = request.form
-        state = getOrInsertState(form.get('state'))
-        city = getOrInsertCity(form.get('city'), state)
-        city.state = state
+        state_id = getOrInsertState(form.get('state'))
+        city = getOrInsertCity(form.get('city'), state_id)
         genres = getOrInsertGenres(form.getlist('genres'))
 
         venue = Venue(name=form.get('name'), city=city, address=form.get(
             'address'), phone=form.get('phone'), facebook_link=form.get('facebook_link'), genres=genres)
 
+        db.session.add(venue)
+        db.session.flush()
+        venue_id = venue.id
         db.session.commit()
     except:
         flash('An error occurred. Venue ' +
               form.get('name') + ' could not be listed.')
         db.session.rollback()
     else:
+        checkLinks.delay('venues', venue_id)
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
     finally:
         db.session.close()
@@ -357,6 +905,7 @@ def delete_venue(venue_id):
     error = False
     try:
         venue = Venue.query.get(venue_id)
+        stale_keys = venueDetailKeys(venue.id)
         for show in venue.shows:
             db.session.delete(show)
 
@@ -368,6 +917,7 @@ def delete_venue(venue_id):
         db.session.rollback()
         error = True
     else:
+        detail_cache.delete(*stale_keys)
         flash('Venue was successfully deleted!')
     finally:
         db.session.close()
@@ -382,52 +932,56 @@ def delete_venue(venue_id):
 
 
 @app.route('/artists')
+@page_cache.page
 def artists():
-    data = Artist.query.all()
-    return render_template('pages/artists.html', artists=data)
+    filters = parseFacetFilters(request.args)
+    query = Artist.query
+    if filters is not None:
+        query = query.filter(Artist.id.in_(artist_facets.ids(**filters)))
+    artists = query.all()
+    page_cache.prefetch('artist-item', [artist.id for artist in artists])
+    return render_template('pages/artists.html', artists=artists, filters=request.args,
+                           genres=Genres.query.order_by(Genres.name).all())
 
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
     search_term = request.form.get('search_term', '')
-    query = Artist.query.filter(Artist.name.ilike(f'%{search_term}%'))
+    limit = min(max(request.form.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_PAGE_MAX)
+    offset = max(request.form.get('offset', 0, type=int), 0)
+    filters = parseFacetFilters(request.form)
+    within = artist_facets.ids(**filters) if filters else None
+    count, data = artist_search.search(search_term, limit, offset, within)
     response = {
-        "count": query.count(),
-        "data": query.all()
+        "count": count,
+        "data": data
     }
-
     return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
+ARTIST_DETAIL_FIELDS = ['id', 'name', 'facebook_link', 'website', 'image_link', 'phone',
+                        'seeking_venue', 'seeking_description']
+
+
 @app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
-    artist = Artist.query.get(artist_id)
-    upcomingShows = getArtistUpcomingShows(artist)
-    pastShows = getArtistPastShows(artist)
-    genres = []
-    for g in artist.genres:
-        genres.append(g.name)
-
-    data = {
-        'id': artist.id,
-        'name': artist.name,
-        'city': artist.city,
-        'state': artist.city.state,
-        'upcoming_shows_count': len(upcomingShows),
-        'upcoming_shows': upcomingShows,
-        'past_shows': pastShows,
-        'past_shows_count': len(pastShows),
-        'genres': genres,
-        'facebook_link': artist.facebook_link,
-        'website': artist.website,
-        'image_link': artist.image_link,
-        'phone': artist.phone,
-        'seeking_venue': artist.seeking_venue,
-        'seeking_description': artist.seeking_description
-    }
+async def show_artist(artist_id):
+    data = await readThroughDetail(artistCacheKey(artist_id), lambda: loadDetail(
+        Artist, artist_id, ARTIST_DETAIL_FIELDS, ArtistGenres.c.artist_id, ShowSummary.artist_id, 'venue'))
+    if data is None:
+        abort(404)
 
     return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/<any(venues, artists):kind>/<int:item_id>/matches')
+def show_matches(kind, item_id):
+    limit = min(max(request.args.get('limit', MATCH_LIMIT, type=int), 1), MATCH_LIMIT_MAX)
+    matches = recommendMatches(kind, item_id, limit)
+    if matches is None:
+        abort(404)
+    model = Venue if kind == 'venues' else Artist
+    name = db.session.query(model.name).filter(model.id == item_id).scalar()
+    return render_template('pages/matches.html', kind=kind, name=name, matches=matches)
+
 #  Update
 #  ----------------------------------------------------------------
 
@@ -447,12 +1001,16 @@ def edit_artist_submission(artist_id):
     error = False
     form = request.form
     try:
+        # Lookups first: their queries autoflush, and must not flush a
+        # half-edited artist
+        state_id = getOrInsertState(form.get('state'))
+        city = getOrInsertCity(form.get('city'), state_id)
+        genres = getOrInsertGenres(form.getlist('genres'))
+
         artist = Artist.query.get(artist_id)
         artist.name = form.get('name')
-        state = getOrInsertState(form.get('state'))
-        artist.city = getOrInsertCity(form.get('city'), state)
-        artist.city.state = state
-        artist.genres = getOrInsertGenres(form.getlist('genres'))
+        artist.city = city
+        artist.genres = genres
         artist.phone = form.get('phone')
         artist.facebook_link = form.get('facebook_link')
 
@@ -461,6 +1019,10 @@ def edit_artist_submission(artist_id):
     except:
         error = True
         db.session.rollback()
+    else:
+        detail_cache.delete(artistCacheKey(artist_id))
+        dropCounterpartPages.delay('artists', artist_id)
+        checkLinks.delay('artists', artist_id)
     finally:
         db.session.close()
 
@@ -485,12 +1047,14 @@ def edit_venue_submission(venue_id):
     error = False
     form = request.form
     try:
+        state_id = getOrInsertState(form.get('state'))
+        city = getOrInsertCity(form.get('city'), state_id)
+        genres = getOrInsertGenres(form.getlist('genres'))
+
         venue = Venue.query.get(venue_id)
         venue.name = form.get('name')
-        state = getOrInsertState(form.get('state'))
-        venue.city = getOrInsertCity(form.get('city'), state)
-        venue.city.state = state
-        venue.genres = getOrInsertGenres(form.getlist('genres'))
+        venue.city = city
+        venue.genres = genres
         venue.phone = form.get('phone')
         venue.address = form.get('address')
         venue.facebook_link = form.get('facebook_link')
@@ -500,6 +1064,10 @@ def edit_venue_submission(venue_id):
     except:
         error = True
         db.session.rollback()
+    else:
+        detail_cache.delete(venueCacheKey(venue_id))
+        dropCounterpartPages.delay('venues', venue_id)
+        checkLinks.delay('venues', venue_id)
     finally:
         db.session.close()
 
@@ -522,22 +1090,29 @@ def create_artist_form():
 def create_artist_submission():
     try:
         form = request.form
+        # Assigning genres cascades the artist into the session, so it is
+        # built only after the lookups, whose queries autoflush
+        state_id = getOrInsertState(form.get('state'))
+        city = getOrInsertCity(form.get('city'), state_id)
+        genres = getOrInsertGenres(form.getlist('genres'))
         artist = Artist(
             name=form.get('name'),
             facebook_link=form.get('facebook_link'),
             phone=form.get('phone'),
+            city=city,
+            genres=genres,
         )
-        artist.genres = getOrInsertGenres(form.getlist('genres'))
-        state = getOrInsertState(form.get('state'))
-        artist.city = getOrInsertCity(form.get('city'), state)
 
         db.session.add(artist)
+        db.session.flush()
+        artist_id = artist.id
         db.session.commit()
     except:
         db.session.rollback()
         flash('An error occurred. Artist ' +
               form.get('name') + ' could not be listed.')
     else:
+        checkLinks.delay('artists', artist_id)
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
     finally:
         db.session.close()
@@ -548,21 +1123,120 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+SHOWS_PAGE_SIZE = 30
+SHOWS_PAGE_MAX = 100
+
+
+def encodeShowCursor(show):
+    return '%s,%d' % (show.start_time.isoformat(), show.id)
+
+
+def decodeShowCursor(value):
+    start_time, show_id = value.rsplit(',', 1)
+    return datetime.datetime.fromisoformat(start_time), int(show_id)
+
+
+CALENDAR_DAYS = 31
+CALENDAR_MAX_DAYS = 366
+
+
+def parseShowRange(args):
+    """Reads the from/to/city/genre calendar arguments. Returns the applied
+    arguments and the SQL conditions on show_summaries; `to` is inclusive.
+    Raises ValueError on malformed values."""
+    applied = {}
+    conditions = []
+    if args.get('from'):
+        start = datetime.datetime.combine(datetime.date.fromisoformat(args['from']), datetime.time())
+        applied['from'] = start.date().isoformat()
+        conditions.append(ShowSummary.start_time >= start)
+    if args.get('to'):
+        end = datetime.datetime.combine(datetime.date.fromisoformat(args['to']), datetime.time())
+        applied['to'] = end.date().isoformat()
+        conditions.append(ShowSummary.start_time < end + datetime.timedelta(days=1))
+    if args.get('city'):
+        applied['city'] = int(args['city'])
+        conditions.append(ShowSummary.venue_city_id == applied['city'])
+    if args.get('genre'):
+        applied['genre'] = args['genre']
+        conditions.append(db.exists().where(
+            ArtistGenres.c.artist_id == ShowSummary.artist_id,
+            ArtistGenres.c.genre_id == Genres.id, Genres.name == applied['genre']))
+    return applied, conditions
+
+
+def calendarWindow(applied):
+    """First and last day the per-day counts cover: the requested range,
+    or CALENDAR_DAYS from its start (today by default), capped at
+    CALENDAR_MAX_DAYS."""
+    first = datetime.date.fromisoformat(applied['from']) if 'from' in applied else datetime.date.today()
+    if 'to' in applied:
+        last = datetime.date.fromisoformat(applied['to'])
+    else:
+        last = first + datetime.timedelta(days=CALENDAR_DAYS - 1)
+    return first, min(last, first + datetime.timedelta(days=CALENDAR_MAX_DAYS - 1))
+
+
+def countShowsPerDay(applied, conditions):
+    """Counts the matching shows of every day in the calendar window with a
+    single grouped query over the start_time index."""
+    first, last = calendarWindow(applied)
+    day = db.func.date(ShowSummary.start_time)
+    rows = db.session.query(day, db.func.count()).filter(
+        ShowSummary.start_time >= datetime.datetime.combine(first, datetime.time()),
+        ShowSummary.start_time < datetime.datetime.combine(
+            last + datetime.timedelta(days=1), datetime.time()),
+        *conditions
+    ).group_by(day).all()
+    counts = {str(row[0]): row[1] for row in rows}
+    return [{'date': first + datetime.timedelta(days=offset),
+             'count': counts.get((first + datetime.timedelta(days=offset)).isoformat(), 0)}
+            for offset in range((last - first).days + 1)]
+
+
 @app.route('/shows')
+@page_cache.page
 def shows():
-    shows = Show.query.all()
+    limit = min(max(request.args.get(
+        'limit', SHOWS_PAGE_SIZE, type=int), 1), SHOWS_PAGE_MAX)
+    after = request.args.get('after')
+    try:
+        applied, conditions = parseShowRange(request.args)
+    except ValueError:
+        abort(400)
+
+    query = ShowSummary.query.filter(*conditions)
+    if after:
+        try:
+            start_time, show_id = decodeShowCursor(after)
+        except ValueError:
+            abort(400)
+        query = query.filter(db.or_(
+            ShowSummary.start_time > start_time,
+            db.and_(ShowSummary.start_time == start_time, ShowSummary.id > show_id)))
+    elif not request.args.get('all') and 'from' not in applied:
+        now = datetime.datetime.now().replace(microsecond=0)
+        query = query.filter(ShowSummary.start_time >= now)
+
+    shows = query.order_by(ShowSummary.start_time, ShowSummary.id).limit(limit + 1).all()
+    next_cursor = encodeShowCursor(
+        shows[limit - 1]) if len(shows) > limit else None
+
     data = []
-    for item in shows:
+    for item in shows[:limit]:
         data.append({
-            'venue_id': item.venue.id,
-            'venue_name': item.venue.name,
-            'artist_id': item.artist.id,
-            'artist_name': item.artist.name,
-            'artist_image_link': item.artist.image_link,
-            'start_time': item.start_time.isoformat()
+            'id': item.id,
+            'venue_id': item.venue_id,
+            'venue_name': item.venue_name,
+            'artist_id': item.artist_id,
+            'artist_name': item.artist_name,
+            'artist_image_link': item.artist_image_link,
+            'start_time': item.start_time
         })
+    page_cache.prefetch('show-tile', [item['id'] for item in data])
 
-    return render_template('pages/shows.html', shows=data)
+    return render_template('pages/shows.html', shows=data, next_cursor=next_cursor, limit=limit,
+                           filters=applied, days=countShowsPerDay(applied, conditions))
 
 
 @app.route('/shows/create')
@@ -585,16 +1259,30 @@ def create_show_submission():
         elif artist is None:
             raise ValueError('Artist id is not listed.')
 
-        newShow = Show(start_time=form.get('start_time'))
+        start_time = parseStartTime(form.get('start_time'))
+        duration = int(form.get('duration') or SHOW_DURATION)
+        if duration <= 0:
+            raise ValueError('Duration must be a positive number of minutes.')
+        conflicts = schedule.conflicts(venue.id, start_time, show_end(start_time, duration))
+        if conflicts:
+            raise ValueError('Venue is already booked by ' + describeConflicts(conflicts) + '.')
+
+        newShow = Show(start_time=start_time, duration=duration)
         newShow.artist = artist
         newShow.venue = venue
+        stale_keys = [venueCacheKey(venue.id), artistCacheKey(artist.id)]
 
         db.session.add(newShow)
         db.session.commit()
     except ValueError as err:
         db.session.rollback()
         flash(err.args if err.args else 'An error occurred. Show could not be listed.')
+    except IntegrityError:
+        # Another booking for the venue committed after the check above
+        db.session.rollback()
+        flash(BOOKING_CONFLICT)
     else:
+        detail_cache.delete(*stale_keys)
         flash('Show was successfully listed!')
     finally:
         db.session.close()
@@ -602,6 +1290,471 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
+TOUR_MAX_SHOWS = 500
+
+
+def parseTourRows(text):
+    """Parses 'artist_id, venue_id, start_time[, duration]' lines into show
+    rows."""
+    rows = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        parts = [part.strip() for part in line.split(',')]
+        try:
+            if len(parts) not in (3, 4):
+                raise ValueError
+            duration = int(parts[3]) if len(parts) == 4 else SHOW_DURATION
+            if duration <= 0:
+                raise ValueError
+            rows.append({'line': number, 'artist_id': int(parts[0]), 'venue_id': int(parts[1]),
+                         'start_time': parseStartTime(parts[2]), 'duration': duration})
+        except (ValueError, OverflowError):
+            raise ValueError('Line %d is not "artist id, venue id, start time[, minutes]".' % number)
+    if not rows:
+        raise ValueError('No shows were given.')
+    if len(rows) > TOUR_MAX_SHOWS:
+        raise ValueError('At most %d shows can be listed at once.' % TOUR_MAX_SHOWS)
+    return rows
+
+
+def findTourProblems(rows):
+    """Checks every referenced id with one IN query per table and looks for
+    double bookings within the batch and against existing shows. A venue
+    or an artist is double booked when the time spans of two of its shows
+    overlap."""
+    problems = []
+    venue_ids = {row['venue_id'] for row in rows}
+    artist_ids = {row['artist_id'] for row in rows}
+    known_venues = {row[0] for row in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))}
+    known_artists = {row[0] for row in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids))}
+
+    stored = schedule.conflicts_many([
+        (row['venue_id'], row['start_time'], show_end(row['start_time'], row['duration']))
+        for row in rows])
+    artist_stored = artist_schedule.conflicts_many([
+        (row['artist_id'], row['start_time'], show_end(row['start_time'], row['duration']))
+        for row in rows])
+    batch = collections.defaultdict(IntervalIndex)
+    artist_batch = collections.defaultdict(IntervalIndex)
+
+    for row, conflicts, artist_conflicts in zip(rows, stored, artist_stored):
+        if row['venue_id'] not in known_venues:
+            problems.append('Line %d: venue %d is not listed.' % (row['line'], row['venue_id']))
+        if row['artist_id'] not in known_artists:
+            problems.append('Line %d: artist %d is not listed.' % (row['line'], row['artist_id']))
+
+        end = show_end(row['start_time'], row['duration'])
+        if conflicts:
+            problems.append('Line %d: venue %d is already booked by %s.' % (
+                row['line'], row['venue_id'], describeConflicts(conflicts)))
+        overlapping = batch[row['venue_id']].overlapping(row['start_time'], end)
+        if overlapping:
+            problems.append('Line %d: venue %d is already booked by line %d.' % (
+                row['line'], row['venue_id'], overlapping[0]))
+        batch[row['venue_id']].add(row['line'], row['start_time'], end)
+
+        if artist_conflicts:
+            problems.append('Line %d: artist %d is already booked by %s.' % (
+                row['line'], row['artist_id'], describeConflicts(artist_conflicts)))
+        overlapping = artist_batch[row['artist_id']].overlapping(row['start_time'], end)
+        if overlapping:
+            problems.append('Line %d: artist %d is already booked by line %d.' % (
+                row['line'], row['artist_id'], overlapping[0]))
+        artist_batch[row['artist_id']].add(row['line'], row['start_time'], end)
+    return problems
+
+
+@app.route('/shows/create-batch')
+def create_tour():
+    form = TourForm()
+    return render_template('forms/new_tour.html', form=form)
+
+
+@app.route('/shows/create-batch', methods=['POST'])
+def create_tour_submission():
+    form = TourForm(request.form)
+    try:
+        rows = parseTourRows(request.form.get('shows', ''))
+        problems = findTourProblems(rows)
+        if problems:
+            raise ValueError(*problems)
+
+        for row in rows:
+            del row['line']
+        ids = db.session.scalars(db.insert(Show).returning(
+            Show.id, sort_by_parameter_order=True), rows).all()
+        insertShowSummaries(db.session.connection(), Show.id.in_(ids))
+        for show_id, row in zip(ids, rows):
+            stageSchedule(db.session, show_id, row['venue_id'], row['artist_id'],
+                          row['start_time'], row['duration'])
+        stale_keys = [venueCacheKey(venue_id) for venue_id in {row['venue_id'] for row in rows}] + \
+            [artistCacheKey(artist_id) for artist_id in {row['artist_id'] for row in rows}]
+        db.session.commit()
+    except ValueError as err:
+        db.session.rollback()
+        for message in err.args:
+            flash(message)
+        return render_template('forms/new_tour.html', form=form)
+    except IntegrityError:
+        db.session.rollback()
+        flash(BOOKING_CONFLICT)
+        return render_template('forms/new_tour.html', form=form)
+    else:
+        detail_cache.delete(*stale_keys)
+        flash('%d shows were successfully listed!' % len(ids))
+    finally:
+        db.session.close()
+
+    return render_template('pages/home.html')
+
+
+#  API
+#  ----------------------------------------------------------------
+
+API_PAGE_SIZE = 50
+API_PAGE_MAX = 200
+
+
+def summarize(item):
+    return {'id': item.id, 'name': item.name, 'image_link': item.image_link}
+
+
+def serializeCity(city):
+    return {'id': city.id, 'name': city.name, 'state': city.state.name if city.state else None}
+
+
+def serializeShow(show):
+    return {'id': show.id, 'venue_id': show.venue_id, 'artist_id': show.artist_id,
+            'start_time': show.start_time.isoformat(), 'duration': show.duration}
+
+
+API_RESOURCES = {
+    'venues': {
+        'model': Venue,
+        'fields': ['id', 'name', 'address', 'phone', 'website', 'facebook_link', 'image_link',
+                   'seeking_talent', 'seeking_description', 'city_id'],
+        'embeds': {
+            'city': (lambda: db.joinedload(Venue.city).joinedload(City.state),
+                     lambda item: serializeCity(item.city) if item.city else None),
+            'genres': (lambda: db.selectinload(Venue.genres),
+                       lambda item: [genre.name for genre in item.genres]),
+            'shows': (lambda: db.selectinload(Venue.shows),
+                      lambda item: [serializeShow(show) for show in item.shows])
+        }
+    },
+    'artists': {
+        'model': Artist,
+        'fields': ['id', 'name', 'phone', 'website', 'facebook_link', 'image_link',
+                   'seeking_venue', 'seeking_description', 'city_id'],
+        'embeds': {
+            'city': (lambda: db.joinedload(Artist.city).joinedload(City.state),
+                     lambda item: serializeCity(item.city) if item.city else None),
+            'genres': (lambda: db.selectinload(Artist.genres),
+                       lambda item: [genre.name for genre in item.genres]),
+            'shows': (lambda: db.selectinload(Artist.shows),
+                      lambda item: [serializeShow(show) for show in item.shows])
+        }
+    },
+    'shows': {
+        'model': Show,
+        'fields': ['id', 'venue_id', 'artist_id', 'start_time', 'duration'],
+        'embeds': {
+            'venue': (lambda: db.joinedload(Show.venue), lambda item: summarize(item.venue)),
+            'artist': (lambda: db.joinedload(Show.artist), lambda item: summarize(item.artist))
+        }
+    },
+    'cities': {
+        'model': City,
+        'fields': ['id', 'name', 'state_id'],
+        'embeds': {
+            'state': (lambda: db.joinedload(City.state), lambda item: item.state.name)
+        }
+    },
+    'genres': {
+        'model': Genres,
+        'fields': ['id', 'name'],
+        'embeds': {}
+    }
+}
+
+
+def parseApiList(value, allowed, name):
+    values = [item for item in (value or '').split(',') if item]
+    unknown = set(values) - set(allowed)
+    if unknown:
+        abort(make_response(jsonify(
+            {'error': 'unknown %s: %s' % (name, ', '.join(sorted(unknown)))}), 400))
+    return values
+
+
+def serializeApiItem(item, resource, fields, embeds):
+    record = {}
+    for field in fields:
+        value = getattr(item, field)
+        record[field] = value.isoformat() if isinstance(value, datetime.datetime) else value
+    for name in embeds:
+        record[name] = resource['embeds'][name][1](item)
+    return record
+
+
+def apiResponse(build):
+    """Answers conditional GETs from the data version alone: the ETag only
+    depends on the request URL and the data version, so a matching
+    If-None-Match returns 304 before any query or serialization runs."""
+    etag = hashlib.sha1(('%s|%s' % (data_version.current(), request.full_path)).encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def apiQuery(resource, embeds):
+    return resource['model'].query.options(*[resource['embeds'][name][0]() for name in embeds])
+
+
+@app.route('/api/v1/<any(venues, artists, shows, cities, genres):kind>')
+def api_list(kind):
+    resource = API_RESOURCES[kind]
+    model = resource['model']
+    fields = parseApiList(request.args.get('fields'), resource['fields'], 'fields') or resource['fields']
+    embeds = parseApiList(request.args.get('embed'), resource['embeds'], 'embeds')
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_PAGE_MAX)
+    after = request.args.get('after', 0, type=int)
+
+    def build():
+        items = apiQuery(resource, embeds).filter(model.id > after).order_by(
+            model.id).limit(limit + 1).all()
+        next_url = None
+        if len(items) > limit:
+            items = items[:limit]
+            args = dict(request.args, after=items[-1].id)
+            next_url = url_for('api_list', kind=kind, **args)
+        return {
+            'data': [serializeApiItem(item, resource, fields, embeds) for item in items],
+            'next': next_url
+        }
+
+    return apiResponse(build)
+
+
+@app.route('/api/v1/<any(venues, artists, shows, cities, genres):kind>/<int:item_id>')
+def api_detail(kind, item_id):
+    resource = API_RESOURCES[kind]
+    model = resource['model']
+    fields = parseApiList(request.args.get('fields'), resource['fields'], 'fields') or resource['fields']
+    embeds = parseApiList(request.args.get('embed'), resource['embeds'], 'embeds')
+
+    def build():
+        item = apiQuery(resource, embeds).filter(model.id == item_id).first()
+        if item is None:
+            abort(make_response(jsonify({'error': 'not found'}), 404))
+        return {'data': serializeApiItem(item, resource, fields, embeds)}
+
+    return apiResponse(build)
+
+
+@app.route('/api/v1/<any(venues, artists):kind>/<int:item_id>/matches')
+def api_matches(kind, item_id):
+    limit = min(max(request.args.get('limit', MATCH_LIMIT, type=int), 1), MATCH_LIMIT_MAX)
+
+    def build():
+        matches = recommendMatches(kind, item_id, limit)
+        if matches is None:
+            abort(make_response(jsonify({'error': 'not found'}), 404))
+        return {'data': matches}
+
+    return apiResponse(build)
+
+
+@app.route('/api/v1/calendar')
+def api_calendar():
+    try:
+        applied, conditions = parseShowRange(request.args)
+    except ValueError:
+        abort(make_response(jsonify({'error': 'invalid from, to or city'}), 400))
+
+    def build():
+        days = countShowsPerDay(applied, conditions)
+        return {
+            'filters': applied,
+            'data': [{'date': day['date'].isoformat(), 'count': day['count']} for day in days]
+        }
+
+    return apiResponse(build)
+
+
+#  Export
+#  ----------------------------------------------------------------
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_FIELDS = {
+    'venues': ['id', 'name', 'city', 'state', 'address', 'phone', 'website', 'facebook_link',
+               'image_link', 'seeking_talent', 'seeking_description', 'genres'],
+    'artists': ['id', 'name', 'city', 'state', 'phone', 'website', 'facebook_link',
+                'image_link', 'seeking_venue', 'seeking_description', 'genres'],
+    'shows': ['id', 'venue_id', 'artist_id', 'start_time', 'duration']
+}
+
+
+def serializeEntity(item, fields):
+    record = {}
+    for field in fields:
+        if field == 'city':
+            record[field] = item.city.name if item.city else None
+        elif field == 'state':
+            record[field] = item.city.state.name if item.city and item.city.state else None
+        elif field == 'genres':
+            record[field] = ','.join(genre.name for genre in item.genres)
+        else:
+            record[field] = getattr(item, field)
+    return record
+
+
+def exportChunk(kind, last_id, size):
+    fields = EXPORT_FIELDS[kind]
+    if kind == 'shows':
+        rows = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time,
+                                Show.duration).filter(
+            Show.id > last_id).order_by(Show.id).limit(size).all()
+        return [{'id': row.id, 'venue_id': row.venue_id, 'artist_id': row.artist_id,
+                 'start_time': row.start_time.isoformat(), 'duration': row.duration}
+                for row in rows]
+
+    model = Venue if kind == 'venues' else Artist
+    items = model.query.options(
+        db.joinedload(model.city).joinedload(City.state),
+        db.selectinload(model.genres)
+    ).filter(model.id > last_id).order_by(model.id).limit(size).all()
+    return [serializeEntity(item, fields) for item in items]
+
+
+def exportRecords(kind, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields every record of `kind` in id order. Rows are read in keyset
+    chunks and the read transaction is ended after each chunk, so memory
+    stays bounded and no snapshot is held for the whole export."""
+    last_id = 0
+    while True:
+        records = exportChunk(kind, last_id, chunk_size)
+        db.session.rollback()
+        if not records:
+            return
+        last_id = records[-1]['id']
+        for record in records:
+            yield record
+
+
+@app.route('/export/<any(venues, artists, shows):kind>.<any(csv, jsonl):format>')
+def export(kind, format):
+    body = exporter.encode(exportRecords(kind), format, EXPORT_FIELDS[kind])
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': 'attachment; filename=%s.%s' % (kind, format)})
+
+
+def showFeedEvents(column, entity_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields calendar events for the shows of one venue or artist in start
+    time order, reading keyset chunks the way exportRecords does."""
+    root = request.url_root
+    last = None
+    while True:
+        query = db.session.query(
+            ShowSummary.id, ShowSummary.start_time, ShowSummary.duration, ShowSummary.venue_id,
+            ShowSummary.venue_name, ShowSummary.artist_name).filter(column == entity_id)
+        if last is not None:
+            query = query.filter(db.or_(
+                ShowSummary.start_time > last.start_time,
+                db.and_(ShowSummary.start_time == last.start_time, ShowSummary.id > last.id)))
+        rows = query.order_by(ShowSummary.start_time, ShowSummary.id).limit(chunk_size).all()
+        db.session.rollback()
+        if not rows:
+            return
+        last = rows[-1]
+        for row in rows:
+            yield {
+                'uid': 'show-%d@%s' % (row.id, request.host),
+                'start': row.start_time,
+                'end': show_end(row.start_time, row.duration or SHOW_DURATION),
+                'summary': '%s at %s' % (row.artist_name, row.venue_name),
+                'location': row.venue_name,
+                'url': '%svenues/%d' % (root, row.venue_id)
+            }
+
+
+@app.route('/<any(venues, artists):kind>/<int:entity_id>/shows.ics')
+def show_feed(kind, entity_id):
+    model = Venue if kind == 'venues' else Artist
+    name = db.session.query(model.name).filter(model.id == entity_id).scalar()
+    if name is None:
+        abort(404)
+    column = ShowSummary.venue_id if kind == 'venues' else ShowSummary.artist_id
+    body = exporter.to_ical(showFeedEvents(column, entity_id), '%s shows' % name,
+                            datetime.datetime.now(datetime.timezone.utc))
+    return Response(stream_with_context(body), mimetype='text/calendar', headers={
+        'Content-Disposition': 'inline; filename=%s-%d.ics' % (kind[:-1], entity_id)})
+
+
+def isKnownImage(url):
+    return db.session.query(db.or_(db.exists().where(Venue.image_link == url),
+                                   db.exists().where(Artist.image_link == url))).scalar()
+
+
+@app.route('/images/<size>')
+def image_thumbnail(size):
+    url = request.args.get('url', '')
+    if size not in image_proxy.sizes or not url:
+        abort(404)
+    found = image_proxy.cached(url, size)
+    if found is None:
+        # Only links stored on a venue or artist are fetched, so the proxy
+        # cannot be pointed at arbitrary hosts
+        if not isKnownImage(url):
+            abort(404)
+        try:
+            found = image_proxy.thumbnail(url, size)
+        except ImageError as err:
+            app.logger.info('Not proxying %s: %s', url, err)
+            abort(404)
+        except OSError as err:
+            app.logger.warning('Fetching %s failed: %s', url, err)
+            abort(502)
+    digest, data = found
+    response = send_file(io.BytesIO(data), mimetype='image/jpeg', etag=digest,
+                         max_age=app.config['IMAGE_MAX_AGE'], conditional=True)
+    response.cache_control.public = True
+    return response
+
+
+@app.route('/tasks/stats')
+def task_stats():
+    return jsonify(tasks.stats())
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(dict(detail_cache.stats(), pages=page_cache.cache.stats(),
+                        images=image_proxy.stats()))
+
+
+def poolStats():
+    pool = db.engine.pool
+    stats = {'pool': type(pool).__name__, 'status': pool.status()}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    stats['replicas'] = replica_router.stats()
+    return stats
+
+
+@app.route('/pool/stats')
+def pool_stats():
+    return jsonify(poolStats())
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -618,16 +1771,439 @@ def reset_db():
 
     db.drop_all()
     db.create_all()
+    clearLookupCaches()
+    data_version.bump()
 
     print("Initialized default DB")
 
 
+@app.cli.command('refresh-summaries')
+@click.option('--full', is_flag=True, help='Rebuild the whole table instead of filling gaps.')
+def refresh_summaries(full):
+    """Syncs show_summaries with shows written outside the ORM"""
+
+    inserted, deleted = refreshShowSummaries(full)
+    print("Inserted %d and deleted %d show summaries" % (inserted, deleted))
+
+
+@app.cli.command('check-summaries')
+def check_summaries():
+    """Verifies show_summaries against shows, venues and artists"""
+
+    problems = checkShowSummaries()
+    for name, ids in problems.items():
+        print("%s: %d%s" % (name, len(ids), ' (e.g. %s)' % ids[:10] if ids else ''))
+    if any(problems.values()):
+        raise click.ClickException('show_summaries is out of sync; run flask refresh-summaries --full')
+
+
+@app.cli.command('worker')
+@click.option('--concurrency', default=2, show_default=True, help='Worker threads.')
+@click.option('--burst', is_flag=True, help='Exit once no job is ready.')
+@click.option('--requeue-after', default=600, show_default=True,
+              help='Requeue jobs left running this many seconds by a dead worker.')
+def run_worker(concurrency, burst, requeue_after):
+    """Processes background tasks from the persistent queue"""
+
+    if tasks.mode != 'sqlite':
+        raise click.ClickException('flask worker needs TASK_QUEUE=sqlite, the %s queue '
+                                   'only lives inside the web process' % tasks.mode)
+    requeued = tasks.store.requeue_stale(requeue_after)
+    if requeued:
+        click.echo('Requeued %d stale jobs' % requeued)
+    click.echo('Worker started with %d threads on %s' % (concurrency, tasks.store.path))
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=tasks.work, kwargs={'stop': stop, 'burst': burst})
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        click.echo('Stopping after the running jobs')
+        stop.set()
+        for thread in threads:
+            thread.join()
+    click.echo(json.dumps(tasks.stats()))
+
+
+@app.cli.command('reindex')
+def reindex_search():
+    """Recomputes the search text of every venue and artist"""
+
+    for model, engine in search_engines.items():
+        for item in model.query.all():
+            item.search_text = searchDocument(item)
+        db.session.commit()
+        engine.reset()
+        facet_indexes[model].reset()
+
+    print("Reindexed venues and artists")
+
+
+def importVenueOrArtistBatch(model, genres_table, batch, keep_ids=False):
+    states = bulkGetOrInsertIds(state_ids, State, [State.name], [
+        record['state'] for record in batch])
+    cities = bulkGetOrInsertIds(city_ids, City, [City.name, City.state_id], [
+        (record['city'], states[record['state']]) for record in batch])
+    genres = bulkGetOrInsertIds(genre_ids, Genres, [Genres.name], [
+        name for record in batch for name in importer.split_list(record.get('genres'))])
+
+    columns = set(model.__table__.columns.keys()) - {'id', 'city_id', 'search_text'}
+    rows = []
+    for record in batch:
+        row = {key: record.get(key) or None for key in columns}
+        for flag in ('seeking_talent', 'seeking_venue'):
+            if flag in columns:
+                row[flag] = importer.parse_bool(record.get(flag))
+        row['city_id'] = cities[(record['city'], states[record['state']])]
+        if keep_ids:
+            row['id'] = int(record['id'])
+        row['search_text'] = ' '.join([record['name'], record['city'], record['state']] +
+                                      importer.split_list(record.get('genres')))
+        rows.append(row)
+
+    ids = db.session.scalars(db.insert(model).returning(
+        model.id, sort_by_parameter_order=True), rows).all()
+
+    links = []
+    owner = genres_table.columns.keys()[0]
+    for entity_id, record in zip(ids, batch):
+        for name in dict.fromkeys(importer.split_list(record.get('genres'))):
+            links.append({owner: entity_id, 'genre_id': genres[name]})
+    if links:
+        db.session.execute(genres_table.insert(), links)
+
+
+def syncIdSequence(model):
+    """Moves the id sequence of `model` past ids inserted explicitly.
+    SQLite picks the next rowid from the table itself."""
+    if db.engine.dialect.name == 'postgresql':
+        table = model.__table__.name
+        db.session.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+            "coalesce(max(id), 0) + 1, false) FROM %s" % table), {'table': table})
+        db.session.commit()
+
+
+def importShowBatch(batch, keep_ids=False):
+    """Inserts a batch of show records after the same checks as a tour;
+    raises ValueError listing the first problems found. A record's line is
+    its position in the batch."""
+    rows = [{
+        'line': number,
+        'venue_id': int(record['venue_id']),
+        'artist_id': int(record['artist_id']),
+        'start_time': parseStartTime(record['start_time']),
+        'duration': int(record.get('duration') or SHOW_DURATION)
+    } for number, record in enumerate(batch, 1)]
+    problems = findTourProblems(rows)
+    if problems:
+        raise ValueError(' '.join(problems[:10]))
+    for row, record in zip(rows, batch):
+        del row['line']
+        if keep_ids:
+            row['id'] = int(record['id'])
+    ids = db.session.scalars(db.insert(Show).returning(
+        Show.id, sort_by_parameter_order=True), rows).all()
+    for show_id, row in zip(ids, rows):
+        stageSchedule(db.session, show_id, row['venue_id'], row['artist_id'],
+                      row['start_time'], row['duration'])
+
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--keep-ids', is_flag=True,
+              help='Insert rows under the ids in the file, as written by `flask export`.')
+def import_data(kind, path, format, batch_size, keep_ids):
+    """Bulk loads venues, artists or shows from a CSV or JSONL file"""
+
+    # Exported shows refer to venues and artists by id, so a dump is
+    # restored by importing all three with --keep-ids into an empty database
+    loaders = {
+        'venues': lambda batch: importVenueOrArtistBatch(Venue, VenueGenres, batch, keep_ids),
+        'artists': lambda batch: importVenueOrArtistBatch(Artist, ArtistGenres, batch, keep_ids),
+        'shows': lambda batch: importShowBatch(batch, keep_ids)
+    }
+    model = {'venues': Venue, 'artists': Artist, 'shows': Show}[kind]
+    started = time.monotonic()
+    total = 0
+    records = importer.read_records(path, format)
+    for number, batch in enumerate(importer.batched(records, batch_size), 1):
+        try:
+            loaders[kind](batch)
+            db.session.commit()
+        except Exception as err:
+            db.session.rollback()
+            raise click.ClickException(
+                'Batch %d (rows %d-%d) failed: %s' % (number, total + 1, total + len(batch), err))
+        total += len(batch)
+        elapsed = time.monotonic() - started
+        click.echo('%s: %d rows, %.0f rows/s' %
+                   (kind, total, total / elapsed if elapsed else 0))
+
+    if keep_ids:
+        syncIdSequence(model)
+    if kind == 'shows':
+        refreshShowSummaries()
+        schedule.reset()
+        artist_schedule.reset()
+    data_version.bump()
+    if kind != 'shows':
+        search_engines[Venue if kind == 'venues' else Artist].reset()
+        facet_indexes[Venue if kind == 'venues' else Artist].reset()
+    print("Imported %d %s" % (total, kind))
+
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.option('--format', type=click.Choice(['csv', 'jsonl']), default='jsonl', show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Defaults to stdout.')
+def export_data(kind, format, output):
+    """Streams all venues, artists or shows as CSV or JSON Lines"""
+
+    for chunk in exporter.encode(exportRecords(kind), format, EXPORT_FIELDS[kind]):
+        output.write(chunk)
+
+
+def captureControllerQueries(paths):
+    """Runs each (method, path, form) through the test client and returns
+    the distinct SELECT statements it issued, grouped by path."""
+    captured = {}
+    current = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            current.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        client = app.test_client()
+        for method, path, form in paths:
+            detail_cache.clear()
+            del current[:]
+            client.open(path, method=method, data=form)
+            captured[method + ' ' + path] = list(
+                dict((statement, params) for statement, params in current).items())
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    return captured
+
+
+def explainStatement(connection, statement, parameters):
+    if connection.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+        return 'cost=%.2f' % plan[0]['Plan']['Total Cost']
+    rows = connection.exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return '; '.join(row[-1] for row in rows)
+
+
+@app.cli.command('explain')
+@click.option('--compare', is_flag=True,
+              help='Also plan every query with the lookup indexes dropped inside a rolled back transaction (PostgreSQL only).')
+@click.option('--search-term', default='a', show_default=True)
+def explain_queries(compare, search_term):
+    """Prints the query plan of every controller query"""
+
+    venue = Venue.query.order_by(Venue.id).first()
+    artist = Artist.query.order_by(Artist.id).first()
+    db.session.close()
+    if venue is None or artist is None:
+        raise click.ClickException('Load some data first, e.g. flask bootstrap')
+    paths = [
+        ('GET', '/venues', None),
+        ('GET', '/artists', None),
+        ('GET', '/shows', None),
+        ('GET', '/shows?all=1', None),
+        ('GET', '/venues/%d' % venue.id, None),
+        ('GET', '/artists/%d' % artist.id, None),
+        ('GET', '/venues/%d/edit' % venue.id, None),
+        ('GET', '/artists/%d/edit' % artist.id, None),
+        ('POST', '/venues/search', {'search_term': search_term}),
+        ('POST', '/artists/search', {'search_term': search_term}),
+    ]
+    captured = captureControllerQueries(paths)
+
+    if compare and db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('--compare needs transactional DDL (PostgreSQL)')
+    indexes = [index.name for table in db.metadata.sorted_tables
+               for index in table.indexes if not index.unique]
+
+    with db.engine.connect() as connection:
+        for route, statements in captured.items():
+            click.echo(route)
+            for statement, parameters in statements:
+                click.echo('  ' + ' '.join(statement.split())[:120])
+                click.echo('    with indexes:    ' + explainStatement(
+                    connection, statement, parameters))
+                # EXPLAIN autobegan a transaction; end it so the indexes are
+                # dropped in one of our own that is then rolled back
+                connection.rollback()
+                if compare:
+                    transaction = connection.begin()
+                    for name in indexes:
+                        connection.exec_driver_sql('DROP INDEX %s' % name)
+                    click.echo('    without indexes: ' + explainStatement(
+                        connection, statement, parameters))
+                    transaction.rollback()
+
+
+@app.cli.command('benchmark')
+@click.option('--states', default=10, show_default=True)
+@click.option('--cities', default=50, show_default=True)
+@click.option('--genres', default=20, show_default=True)
+@click.option('--venues', default=500, show_default=True)
+@click.option('--artists', default=1000, show_default=True)
+@click.option('--shows', default=10000, show_default=True)
+@click.option('--requests', 'repeat', default=30, show_default=True, help='Requests per route.')
+@click.option('--cold', is_flag=True, help='Clear the detail and page caches before every request.')
+@click.option('--seed', default=0, show_default=True)
+def run_benchmark(states, cities, genres, venues, artists, shows, repeat, cold, seed):
+    """Drops the database, loads a synthetic catalog and times every route"""
+
+    db.drop_all()
+    db.create_all()
+    clearLookupCaches()
+    data_version.bump()
+    detail_cache.clear()
+    for engine in search_engines.values():
+        engine.reset()
+    for index in facet_indexes.values():
+        index.reset()
+    schedule.reset()
+    artist_schedule.reset()
+    artist_matches.reset()
+    venue_matches.reset()
+
+    catalog = benchmark.SyntheticCatalog(states, cities, genres, seed)
+    started = time.monotonic()
+    for batch in importer.batched(catalog.venues(venues), 1000):
+        importVenueOrArtistBatch(Venue, VenueGenres, batch)
+    for batch in importer.batched(catalog.artists(artists), 1000):
+        importVenueOrArtistBatch(Artist, ArtistGenres, batch)
+    venue_ids = [row[0] for row in db.session.query(Venue.id)]
+    artist_ids = [row[0] for row in db.session.query(Artist.id)]
+    for batch in importer.batched(catalog.shows(shows, venue_ids, artist_ids), 10000):
+        importShowBatch(batch)
+        # Ends the write transaction before the next batch reads the data
+        # version on its own connection, which SQLite would block
+        db.session.commit()
+    refreshShowSummaries()
+    db.session.close()
+    click.echo('Loaded %d venues, %d artists, %d shows in %.1fs' % (
+        venues, artists, shows, time.monotonic() - started))
+
+    pick = catalog.random.choice
+    form = lambda kind, number: dict(catalog.entity(kind, number), genres=[pick(catalog.genres)])
+    upcoming = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(days=30)
+    routes = [
+        ('GET /', [('GET', '/', None)] * repeat),
+        ('GET /venues', [('GET', '/venues', None)] * repeat),
+        ('GET /artists', [('GET', '/artists', None)] * repeat),
+        ('GET /shows', [('GET', '/shows', None)] * repeat),
+        ('GET /shows?all=1', [('GET', '/shows?all=1', None)] * repeat),
+        ('GET /venues/<id>', [('GET', '/venues/%d' % pick(venue_ids), None) for _ in range(repeat)]),
+        ('GET /artists/<id>', [('GET', '/artists/%d' % pick(artist_ids), None) for _ in range(repeat)]),
+        ('GET /venues/<id>/edit', [('GET', '/venues/%d/edit' % pick(venue_ids), None) for _ in range(repeat)]),
+        ('GET /artists/<id>/edit', [('GET', '/artists/%d/edit' % pick(artist_ids), None) for _ in range(repeat)]),
+        ('GET /venues/create', [('GET', '/venues/create', None)] * repeat),
+        ('GET /artists/create', [('GET', '/artists/create', None)] * repeat),
+        ('GET /shows/create', [('GET', '/shows/create', None)] * repeat),
+        ('POST /venues/search', [('POST', '/venues/search', {'search_term': pick(catalog.genres)}) for _ in range(repeat)]),
+        ('POST /artists/search', [('POST', '/artists/search', {'search_term': pick(catalog.cities)[0]}) for _ in range(repeat)]),
+        ('GET /export/shows.csv', [('GET', '/export/shows.csv', None)] * max(1, repeat // 10)),
+        ('POST /venues/create', [('POST', '/venues/create', form('bench venue', n)) for n in range(repeat)]),
+        ('POST /artists/create', [('POST', '/artists/create', form('bench artist', n)) for n in range(repeat)]),
+        ('POST /shows/create', [('POST', '/shows/create', {
+            'venue_id': pick(venue_ids), 'artist_id': pick(artist_ids),
+            'start_time': (upcoming + datetime.timedelta(days=n)).isoformat()}) for n in range(repeat)]),
+        ('POST /venues/<id>/edit', [('POST', '/venues/%d/edit' % pick(venue_ids), form('venue', n)) for n in range(repeat)]),
+        ('POST /artists/<id>/edit', [('POST', '/artists/%d/edit' % pick(artist_ids), form('artist', n)) for n in range(repeat)]),
+    ]
+
+    client = app.test_client()
+
+    def clearCaches():
+        detail_cache.clear()
+        page_cache.cache.clear()
+
+    before = clearCaches if cold else None
+    results = [benchmark.drive(client, label, requests, before) for label, requests in routes]
+
+    created = [row[0] for row in db.session.query(Venue.id).filter(
+        Venue.name.like('Bench venue %')).limit(repeat)]
+    db.session.close()
+    results.append(benchmark.drive(client, 'DELETE /venues/<id>', [
+        ('DELETE', '/venues/%d' % venue_id, None) for venue_id in created], before, measure_memory=False))
+
+    click.echo(benchmark.format_report(results))
+
+
+@app.cli.command('bench-concurrency')
+@click.option('--base-url', default='http://127.0.0.1:8000', show_default=True)
+@click.option('--clients', default=100, show_default=True)
+@click.option('--requests', 'total', default=2000, show_default=True)
+def bench_concurrency(base_url, clients, total):
+    """Loads the detail pages of a running server from many clients.
+    Start the server with CACHE_TTL=0 to measure uncached page builds."""
+
+    venue_ids = [row[0] for row in db.session.query(Venue.id).limit(200)]
+    artist_ids = [row[0] for row in db.session.query(Artist.id).limit(200)]
+    db.session.close()
+    urls = ['%s/venues/%d' % (base_url, i) for i in venue_ids] + \
+        ['%s/artists/%d' % (base_url, i) for i in artist_ids]
+    if not urls:
+        raise click.ClickException('Load some data first, e.g. flask benchmark')
+
+    result, throughput = benchmark.hammer(urls, clients, total)
+    click.echo(benchmark.format_report([result]))
+    click.echo('%.0f requests/s' % throughput)
+
+
+@app.cli.command('bench-datetime')
+@click.option('--rows', default=10000, show_default=True)
+@click.option('--distinct', default=500, show_default=True, help='Distinct start times among the rows.')
+def bench_datetime(rows, distinct):
+    """Times the datetime filter against dateutil + babel per call"""
+
+    now = datetime.datetime.now().replace(microsecond=0)
+    values = [now + datetime.timedelta(hours=i % distinct) for i in range(rows)]
+    strings = [value.isoformat() for value in values]
+
+    def legacy(value):
+        return babel.dates.format_datetime(dateutil.parser.parse(value), DATETIME_FORMATS['full'])
+
+    timings = []
+    for label, formatter, inputs in (
+            ('dateutil + babel (before)', legacy, strings),
+            ('cached, ISO strings', lambda value: format_datetime(value, 'full'), strings),
+            ('cached, datetimes', lambda value: format_datetime(value, 'full'), values)):
+        formatTimestamp.cache_clear()
+        started = time.perf_counter()
+        output = [formatter(value) for value in inputs]
+        timings.append((label, time.perf_counter() - started, output))
+
+    baseline = timings[0][1]
+    for label, elapsed, output in timings:
+        assert output == timings[0][2], label + ' output differs'
+        click.echo('%-28s %8.1f ms  %6.1fx' % (label, elapsed * 1000, baseline / elapsed))
+
+
 @app.cli.command('bootstrap')
 def bootstrap_data():
     """Populates database with data"""
 
     db.drop_all()
     db.create_all()
+    clearLookupCaches()
+    data_version.bump()
 
     st1 = State(name="CA")
     st2 = State(name="NY")
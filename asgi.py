@@ -0,0 +1,13 @@
+"""ASGI entry point.
+
+    $ uvicorn asgi:application --workers 4
+
+Flask stays a WSGI application; asgiref runs each request on a thread
+pool, and async views (the venue and artist detail pages) fan their
+independent queries out with asyncio.gather.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+
+application = WsgiToAsgi(app)
@@ -0,0 +1,155 @@
+import datetime
+import random
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class SyntheticCatalog(object):
+    """Deterministic fake venues, artists and shows in the record format
+    accepted by `flask import`."""
+
+    def __init__(self, states=10, cities=50, genres=20, seed=0):
+        self.random = random.Random(seed)
+        self.states = ['S%02d' % i for i in range(states)]
+        self.cities = [('City %d' % i, self.states[i % states]) for i in range(cities)]
+        self.genres = ['genre %d' % i for i in range(genres)]
+
+    def entity(self, kind, number):
+        city, state = self.random.choice(self.cities)
+        return {
+            'name': '%s %d' % (kind.capitalize(), number),
+            'city': city,
+            'state': state,
+            'address': '%d Main Street' % number,
+            'phone': '555-%04d' % (number % 10000),
+            'genres': ','.join(self.random.sample(
+                self.genres, self.random.randint(1, min(3, len(self.genres))))),
+            'seeking_talent': self.random.random() < 0.3,
+            'seeking_venue': self.random.random() < 0.3,
+            'seeking_description': 'Looking for a match',
+            'image_link': 'https://example.com/%s/%d.jpg' % (kind, number)
+        }
+
+    def venues(self, count):
+        for number in range(count):
+            yield self.entity('venue', number)
+
+    def artists(self, count):
+        for number in range(count):
+            yield self.entity('artist', number)
+
+    def shows(self, count, venue_ids, artist_ids, spread_days=180, slot_hours=3):
+        """Shows start on a `slot_hours` grid, longer than a default show,
+        and no venue or artist gets two shows in one slot, so the catalog
+        passes the import's double booking checks."""
+        slots = spread_days * 24 // slot_hours
+        if count > (2 * slots + 1) * min(len(venue_ids), len(artist_ids)):
+            raise ValueError('%d shows do not fit in %d days' % (count, spread_days))
+        now = datetime.datetime.now().replace(microsecond=0)
+        taken = set()
+        for _ in range(count):
+            while True:
+                venue_id = self.random.choice(venue_ids)
+                artist_id = self.random.choice(artist_ids)
+                slot = self.random.randint(-slots, slots)
+                if ('venue', venue_id, slot) not in taken and ('artist', artist_id, slot) not in taken:
+                    break
+            taken.update((('venue', venue_id, slot), ('artist', artist_id, slot)))
+            yield {
+                'venue_id': venue_id,
+                'artist_id': artist_id,
+                'start_time': (now + datetime.timedelta(hours=slot * slot_hours)).isoformat()
+            }
+
+
+class RouteResult(object):
+
+    def __init__(self, label):
+        self.label = label
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+        self.peak_memory = 0
+
+    def row(self):
+        ms = [latency * 1000 for latency in self.latencies]
+        return (self.label, len(ms), percentile(ms, 0.5), percentile(ms, 0.95),
+                percentile(ms, 0.99),
+                sum(self.queries) / len(self.queries) if self.queries else 0.0,
+                self.peak_memory / 1024.0, self.errors)
+
+
+def drive(client, label, requests, before=None, measure_memory=True):
+    """Issues each (method, path, data) in `requests` through the Flask test
+    client, timing it and reading the query count from X-DB-Query-Count.
+    The first request is repeated once under tracemalloc for peak memory."""
+    result = RouteResult(label)
+    for method, path, data in requests:
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        response.get_data()
+        result.latencies.append(time.perf_counter() - started)
+        result.queries.append(int(response.headers.get('X-DB-Query-Count', 0)))
+        if response.status_code >= 400:
+            result.errors += 1
+
+    if requests and measure_memory:
+        method, path, data = requests[0]
+        if before is not None:
+            before()
+        tracemalloc.start()
+        client.open(path, method=method, data=data).get_data()
+        result.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def format_report(results):
+    header = ('route', 'n', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB', 'errors')
+    lines = ['%-28s %6s %9s %9s %9s %8s %9s %6s' % header]
+    for result in results:
+        lines.append('%-28s %6d %9.2f %9.2f %9.2f %8.1f %9.1f %6d' % result.row())
+    return '\n'.join(lines)
+
+
+def hammer(urls, clients=100, total=2000, timeout=30):
+    """Fetches `urls` round-robin from `clients` concurrent threads against a
+    running server and returns a RouteResult plus requests per second."""
+    result = RouteResult('%d clients' % clients)
+    lock = threading.Lock()
+
+    def fetch(number):
+        url = urls[number % len(urls)]
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read()
+                queries = int(response.headers.get('X-DB-Query-Count', 0))
+                failed = False
+        except (urllib.error.URLError, OSError):
+            queries = 0
+            failed = True
+        elapsed = time.perf_counter() - started
+        with lock:
+            result.latencies.append(elapsed)
+            result.queries.append(queries)
+            result.errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(fetch, range(total)))
+    return result, total / (time.perf_counter() - started)
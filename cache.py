@@ -0,0 +1,351 @@
+import datetime
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, after_this_request, g, has_request_context, make_response, request, session
+from markupsafe import Markup
+from sqlalchemy import BigInteger, Column, DateTime, Integer, Table, event, select
+
+
+class MemoryBackend(object):
+    """Process-local LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        with self.lock:
+            expires = time.monotonic() + self.ttl
+            for key, value in values.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend(object):
+    """Cache shared between processes, stored as JSON in Redis.
+
+    Works against any server speaking the Redis protocol, so a local
+    redis-server (or fakeredis in tests) can stand in for production."""
+
+    def __init__(self, url, ttl=300, prefix='fyyur:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + key for key in keys])
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def set_many(self, values):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        pipeline.execute()
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache(object):
+    """Read-through cache in front of a backend, counting hits and misses."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_many(self, keys):
+        found = self.backend.get_many(keys)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def set_many(self, values):
+        if values:
+            self.backend.set_many(values)
+
+    def delete(self, *keys):
+        self.backend.delete(*keys)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+def create_cache(config):
+    if config.get('CACHE_BACKEND') == 'redis':
+        backend = RedisBackend(config['CACHE_URL'], ttl=config['CACHE_TTL'])
+    else:
+        backend = MemoryBackend(
+            max_entries=config['CACHE_MAX_ENTRIES'], ttl=config['CACHE_TTL'])
+    return Cache(backend)
+
+
+class DataVersion(object):
+    """Version of the database contents, kept in a one-row table so every
+    worker process and CLI command sees the same number.
+
+    A session transaction that wrote rows increments the counter right
+    before it commits, inside that transaction, so a new version becomes
+    visible together with the rows it describes. Anything derived from the
+    database can use `current()` as a freshness key; requests read it once.
+    Changes to in-process indexes are staged on the session with `stage`
+    and applied after the commit along with the version it produced, and
+    discarded if the transaction rolls back."""
+
+    def __init__(self, db, table_name='data_version'):
+        self.db = db
+        self.table = Table(
+            table_name, db.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('counter', BigInteger, nullable=False),
+            Column('changed_at', DateTime, nullable=False))
+        event.listen(self.table, 'after_create', self.insert_row)
+
+    def now(self):
+        return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    def first_counter(self):
+        # Counting from the clock means a recreated database never repeats
+        # a version that a shared cache may still hold entries for
+        return int(time.time() * 1000)
+
+    def insert_row(self, target, connection, **kwargs):
+        connection.execute(self.table.insert().values(
+            id=1, counter=self.first_counter(), changed_at=self.now()))
+
+    def read(self):
+        # Always the primary: a lagging replica would report an old version
+        with self.db.engine.connect() as connection:
+            row = connection.execute(select(self.table.c.counter, self.table.c.changed_at).where(
+                self.table.c.id == 1)).first()
+        if row is None:
+            return 0, datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+        return row.counter, row.changed_at.replace(tzinfo=datetime.timezone.utc)
+
+    def state(self):
+        """(counter, changed_at), read once per request."""
+        if has_request_context():
+            state = g.get('data_version')
+            if state is None:
+                state = g.data_version = self.read()
+            return state
+        return self.read()
+
+    def current(self):
+        return self.state()[0]
+
+    @property
+    def changed_at(self):
+        return self.state()[1]
+
+    def remember(self, state):
+        if has_request_context():
+            g.data_version = state
+
+    def increment(self, connection):
+        now = self.now()
+        counter = connection.execute(self.table.update().where(self.table.c.id == 1).values(
+            counter=self.table.c.counter + 1, changed_at=now).returning(self.table.c.counter)).scalar()
+        if counter is None:
+            counter = self.first_counter()
+            connection.execute(self.table.insert().values(id=1, counter=counter, changed_at=now))
+        return counter, now.replace(tzinfo=datetime.timezone.utc)
+
+    def bump(self):
+        """Moves the version on outside any session, e.g. after DDL."""
+        with self.db.engine.begin() as connection:
+            state = self.increment(connection)
+        self.remember(state)
+        return state[0]
+
+    def watch(self, session):
+        event.listen(session, 'after_flush', self.mark_dirty)
+        event.listen(session, 'do_orm_execute', self.mark_statement)
+        event.listen(session, 'before_commit', self.write)
+        event.listen(session, 'after_commit', self.publish)
+        event.listen(session, 'after_transaction_end', self.discard)
+
+    def mark_dirty(self, session, flush_context):
+        if session.new or session.dirty or session.deleted:
+            session.info['data_changed'] = True
+
+    def mark_statement(self, orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            orm_execute_state.session.info['data_changed'] = True
+
+    def touch(self, session):
+        """Marks the session's transaction as writing, for statements run
+        on its connection directly."""
+        session.info['data_changed'] = True
+
+    def stage(self, session, apply, *args):
+        """Calls `apply(*args, version=...)` once the session commits."""
+        session.info.setdefault('staged_changes', []).append((apply, args))
+
+    def write(self, session):
+        session.flush()
+        if session.info.pop('data_changed', False):
+            connection = session.connection(bind_arguments={'bind': self.db.engine})
+            session.info['written_version'] = self.increment(connection)
+
+    def publish(self, session):
+        state = session.info.pop('written_version', None)
+        if state is not None:
+            self.remember(state)
+        for apply, args in session.info.pop('staged_changes', []):
+            apply(*args, version=None if state is None else state[0])
+
+    def discard(self, session, transaction):
+        if transaction.parent is None:
+            for key in ('data_changed', 'written_version', 'staged_changes'):
+                session.info.pop(key, None)
+
+
+class PageCache(object):
+    """Caches rendered GET responses and template fragments under the data
+    version, so any committed write retires every entry at once.
+
+    Cached pages go out with an ETag, Last-Modified and a public max-age,
+    letting a reverse proxy serve them and clients revalidate with a 304.
+    Requests with pending flash messages are rendered fresh because the
+    layout consumes them."""
+
+    def __init__(self, cache, version, enabled=True, max_age=30):
+        self.cache = cache
+        self.version = version
+        self.enabled = enabled
+        self.max_age = max_age
+
+    def page(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or '_flashes' in session:
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(('%s|%s' % (
+                self.version.current(), request.full_path)).encode()).hexdigest()
+            entry = self.cache.get('page:' + etag)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = {'body': response.get_data(as_text=True),
+                         'mimetype': response.mimetype}
+                self.cache.set('page:' + etag, entry)
+            response = Response(entry['body'], mimetype=entry['mimetype'])
+            response.set_etag(etag)
+            response.last_modified = self.version.changed_at
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            return response.make_conditional(request)
+        return wrapper
+
+    def fragment_key(self, key):
+        return 'fragment:%s:%s' % (self.version.current(), ':'.join(str(part) for part in key))
+
+    def prefetch(self, name, ids):
+        """Reads the `name` fragments of every id in `ids` with one cache
+        round trip, so a listing does not issue a GET per item."""
+        if not self.enabled:
+            return
+        keys = [self.fragment_key((name, item_id)) for item_id in ids]
+        found = self.cache.get_many(keys)
+        prefetched = g.setdefault('prefetched_fragments', {})
+        for key in keys:
+            prefetched[key] = found.get(key)
+
+    def fragment(self, *key, caller):
+        """Template helper: `{% call cache_fragment('venue', venue.id) %}`
+        renders the block once per data version. Fragments loaded by
+        `prefetch` are taken from the request; the ones rendered here are
+        written back in one batch after the response."""
+        if not self.enabled:
+            return caller()
+        cache_key = self.fragment_key(key)
+        prefetched = g.get('prefetched_fragments', {})
+        body = prefetched[cache_key] if cache_key in prefetched else self.cache.get(cache_key)
+        if body is None:
+            body = str(caller())
+            if 'rendered_fragments' not in g:
+                g.rendered_fragments = {}
+                after_this_request(self.store_fragments)
+            g.rendered_fragments[cache_key] = body
+        return Markup(body)
+
+    def store_fragments(self, response):
+        self.cache.set_many(g.pop('rendered_fragments', {}))
+        return response
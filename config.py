@@ -1,14 +1,146 @@
 import os
-SECRET_KEY = os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# Every setting below can be overridden from the environment. FYYUR_ENV
+# picks the profile that supplies the defaults.
+ENV = os.environ.get('FYYUR_ENV', 'development')
+
+PROFILES = {
+    'development': {
+        'DEBUG': True,
+        'DATABASE_URL': 'postgres://nureddin@localhost:5432/fyyur',
+        'DB_POOL_SIZE': 5,
+        'DB_MAX_OVERFLOW': 5,
+        'DB_STATEMENT_TIMEOUT_MS': 0,
+        'SQL_STRICT_BUDGET': False,
+        'PAGE_CACHE': False,
+        'TASK_QUEUE': 'memory',
+    },
+    'production': {
+        'DEBUG': False,
+        'DATABASE_URL': 'postgres://localhost:5432/fyyur',
+        'DB_POOL_SIZE': 20,
+        'DB_MAX_OVERFLOW': 10,
+        'DB_STATEMENT_TIMEOUT_MS': 5000,
+        'SQL_STRICT_BUDGET': False,
+        'PAGE_CACHE': True,
+        'TASK_QUEUE': 'sqlite',
+    },
+    'testing': {
+        'DEBUG': False,
+        'DATABASE_URL': 'sqlite:///' + os.path.join(basedir, 'test.db'),
+        'DB_POOL_SIZE': 5,
+        'DB_MAX_OVERFLOW': 5,
+        'DB_STATEMENT_TIMEOUT_MS': 0,
+        'SQL_STRICT_BUDGET': True,
+        'PAGE_CACHE': False,
+        'TASK_QUEUE': 'eager',
+        'LINK_CHECKS': False,
+        'LINK_ALLOWED_HOSTS': '127.0.0.1',
+    },
+}
+
+if ENV not in PROFILES:
+    raise RuntimeError('Unknown FYYUR_ENV %r, expected one of %s' %
+                       (ENV, ', '.join(sorted(PROFILES))))
+
+
+def setting(name, default=None, cast=str):
+    value = os.environ.get(name)
+    if value is None:
+        return PROFILES[ENV].get(name, default)
+    if cast is bool:
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
+SECRET_KEY = os.environ.get('SECRET_KEY') or os.urandom(32)
+
 # Enable debug mode.
-DEBUG = True
+DEBUG = setting('DEBUG', cast=bool)
+TESTING = ENV == 'testing'
 
 # Connect to the database
+SQLALCHEMY_DATABASE_URI = setting('DATABASE_URL')
+if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+    # SQLAlchemy only accepts the postgresql:// scheme
+    SQLALCHEMY_DATABASE_URI = 'postgresql://' + \
+        SQLALCHEMY_DATABASE_URI[len('postgres://'):]
+
+# Change tracking adds per-object overhead and nothing here listens for it
+SQLALCHEMY_TRACK_MODIFICATIONS = setting(
+    'SQLALCHEMY_TRACK_MODIFICATIONS', False, bool)
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_pre_ping': setting('DB_POOL_PRE_PING', True, bool),
+    'pool_recycle': setting('DB_POOL_RECYCLE', 1800, int),
+    'query_cache_size': setting('DB_STATEMENT_CACHE_SIZE', 500, int),
+}
+if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+    SQLALCHEMY_ENGINE_OPTIONS.update({
+        'pool_size': setting('DB_POOL_SIZE', cast=int),
+        'max_overflow': setting('DB_MAX_OVERFLOW', cast=int),
+        'pool_timeout': setting('DB_POOL_TIMEOUT', 30, int),
+    })
+DB_STATEMENT_TIMEOUT_MS = setting('DB_STATEMENT_TIMEOUT_MS', cast=int)
+if DB_STATEMENT_TIMEOUT_MS and SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
+    SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = {
+        'options': '-c statement_timeout=%d' % DB_STATEMENT_TIMEOUT_MS}
+
+# Comma separated read replica URLs; GET requests and searches read from
+# them, submissions always hit the primary. REPLICA_STICKY_SECONDS is the
+# lag allowed for: reads stay on the primary that long after any write
+DATABASE_REPLICA_URLS = [url.strip() for url in setting(
+    'DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_STICKY_SECONDS = setting('REPLICA_STICKY_SECONDS', 5, int)
+REPLICA_HEALTH_INTERVAL = setting('REPLICA_HEALTH_INTERVAL', 10, int)
+
+# Detail page cache: 'memory' (per process LRU) or 'redis' (shared)
+CACHE_BACKEND = setting('CACHE_BACKEND', 'memory')
+CACHE_URL = setting('CACHE_URL', 'redis://localhost:6379/0')
+CACHE_TTL = setting('CACHE_TTL', 300, int)
+CACHE_MAX_ENTRIES = setting('CACHE_MAX_ENTRIES', 1024, int)
+
+# Rendered listing pages and template fragments, keyed on the data version;
+# PAGE_CACHE_MAX_AGE is how long clients and proxies may reuse a page
+PAGE_CACHE = setting('PAGE_CACHE', cast=bool)
+PAGE_CACHE_MAX_AGE = setting('PAGE_CACHE_MAX_AGE', 30, int)
+
+# Seconds the matchmaking candidate arrays may lag behind writes before
+# they are rebuilt
+MATCH_POOL_MAX_STALE = setting('MATCH_POOL_MAX_STALE', 60, int)
+
+# Background tasks: 'memory' (worker threads in this process), 'sqlite'
+# (persistent queue at TASK_QUEUE_PATH, also drained by `flask worker`) or
+# 'eager' (run inline)
+TASK_QUEUE = setting('TASK_QUEUE')
+TASK_QUEUE_PATH = setting('TASK_QUEUE_PATH', os.path.join(basedir, 'tasks.db'))
+TASK_WORKERS = setting('TASK_WORKERS', 2, int)
+TASK_MAX_ATTEMPTS = setting('TASK_MAX_ATTEMPTS', 5, int)
+TASK_RETRY_DELAY = setting('TASK_RETRY_DELAY', 2.0, float)
+TASK_RETRY_MAX_DELAY = setting('TASK_RETRY_MAX_DELAY', 300.0, float)
+
+# Saved venue and artist links are checked (and image links fetched) in
+# the background; off in testing so the suite makes no network calls
+LINK_CHECKS = setting('LINK_CHECKS', True, bool)
+# Non-public hosts those requests may still reach; honoured only in the
+# testing profile, where a local server stands in for remote sites
+LINK_ALLOWED_HOSTS = [host.strip() for host in setting(
+    'LINK_ALLOWED_HOSTS', '').split(',') if host.strip()] if TESTING else []
 
+# Image links are served through /images/<size> as thumbnails rendered
+# once and kept in IMAGE_CACHE_DIR, pruned back to IMAGE_CACHE_MAX_BYTES
+# least recently used first
+IMAGE_PROXY = setting('IMAGE_PROXY', True, bool)
+IMAGE_CACHE_DIR = setting('IMAGE_CACHE_DIR', os.path.join(basedir, 'image_cache'))
+IMAGE_CACHE_MAX_BYTES = setting('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024, int)
+IMAGE_FETCH_TIMEOUT = setting('IMAGE_FETCH_TIMEOUT', 5, int)
+IMAGE_MAX_SOURCE_BYTES = setting('IMAGE_MAX_SOURCE_BYTES', 10 * 1024 * 1024, int)
+IMAGE_MAX_AGE = setting('IMAGE_MAX_AGE', 30 * 24 * 3600, int)
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgres://nureddin@localhost:5432/fyyur'
-SQLALCHEMY_TRACK_MODIFICATIONS = True
\ No newline at end of file
+# Per request query counting (X-DB-* headers); strict mode fails any
+# request issuing more than SQL_QUERY_BUDGET queries
+SQL_INSTRUMENTATION = setting('SQL_INSTRUMENTATION', True, bool)
+SQL_QUERY_BUDGET = setting('SQL_QUERY_BUDGET', 25, int)
+SQL_STRICT_BUDGET = setting('SQL_STRICT_BUDGET', cast=bool)
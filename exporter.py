@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+
+
+def to_jsonl(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def to_csv(records, fields):
+    """Encodes records as CSV one row at a time, reusing a single buffer."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def encode(records, format, fields):
+    if format == 'csv':
+        return to_csv(records, fields)
+    return to_jsonl(records)
+
+
+def ical_escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(
+        ',', '\\,').replace('\n', '\\n')
+
+
+def ical_fold(line):
+    """Splits a content line into 75 octet pieces as RFC 5545 requires,
+    without cutting a UTF-8 sequence in half."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    pieces = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        pieces.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = 74
+    return '\r\n '.join(pieces) + '\r\n'
+
+
+def to_ical(events, name, stamp):
+    """Encodes events (dicts with uid, start, end, summary, location and
+    url) as an iCalendar feed, one VEVENT at a time. Times are written as
+    floating local times, matching how shows are stored."""
+    yield ical_fold('BEGIN:VCALENDAR')
+    yield ical_fold('VERSION:2.0')
+    yield ical_fold('PRODID:-//Fyyur//Shows//EN')
+    yield ical_fold('X-WR-CALNAME:' + ical_escape(name))
+    stamp = stamp.strftime('%Y%m%dT%H%M%SZ')
+    for event in events:
+        yield ''.join(ical_fold(line) for line in (
+            'BEGIN:VEVENT',
+            'UID:' + event['uid'],
+            'DTSTAMP:' + stamp,
+            'DTSTART:' + event['start'].strftime('%Y%m%dT%H%M%S'),
+            'DTEND:' + event['end'].strftime('%Y%m%dT%H%M%S'),
+            'SUMMARY:' + ical_escape(event['summary']),
+            'LOCATION:' + ical_escape(event['location']),
+            'URL:' + event['url'],
+            'END:VEVENT'))
+    yield ical_fold('END:VCALENDAR')
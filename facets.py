@@ -0,0 +1,140 @@
+import threading
+from collections import defaultdict
+
+
+def bits_to_ids(bits):
+    """Ids of the set bits of `bits`, ascending."""
+    digits = bin(bits)[:1:-1]
+    return [index for index, digit in enumerate(digits) if digit == '1']
+
+
+class Facets(object):
+    """Per-genre, per-city and seeking bitsets over one model's ids.
+
+    Bit n of a bitset is set when the entity with id n has the facet, so
+    combining filters is integer AND/OR instead of joins over the genre
+    association tables. Genres are keyed by lower-cased name."""
+
+    def __init__(self):
+        self.entities = {}
+        self.everything = 0
+        self.genres = defaultdict(int)
+        self.cities = defaultdict(int)
+        self.seeking = 0
+        self.lock = threading.Lock()
+
+    def add(self, entity_id, genres, city_id, seeking):
+        with self.lock:
+            self._remove(entity_id)
+            bit = 1 << entity_id
+            genres = frozenset(genre.lower() for genre in genres)
+            self.entities[entity_id] = (genres, city_id, seeking)
+            self.everything |= bit
+            for genre in genres:
+                self.genres[genre] |= bit
+            if city_id is not None:
+                self.cities[city_id] |= bit
+            if seeking:
+                self.seeking |= bit
+
+    def remove(self, entity_id):
+        with self.lock:
+            self._remove(entity_id)
+
+    def _remove(self, entity_id):
+        entry = self.entities.pop(entity_id, None)
+        if entry is None:
+            return
+        genres, city_id, seeking = entry
+        mask = ~(1 << entity_id)
+        self.everything &= mask
+        for genre in genres:
+            self.genres[genre] &= mask
+            if not self.genres[genre]:
+                del self.genres[genre]
+        if city_id is not None:
+            self.cities[city_id] &= mask
+            if not self.cities[city_id]:
+                del self.cities[city_id]
+        self.seeking &= mask
+
+    def match(self, genres=(), match_all=True, city_id=None, seeking=False):
+        """Bitset of the entities having all (or, with match_all off, any) of
+        `genres`, located in `city_id` and seeking, for the filters given."""
+        with self.lock:
+            bits = self.everything
+            if genres:
+                sets = [self.genres.get(genre.lower(), 0) for genre in genres]
+                combined = sets[0]
+                for other in sets[1:]:
+                    combined = combined & other if match_all else combined | other
+                bits &= combined
+            if city_id is not None:
+                bits &= self.cities.get(city_id, 0)
+            if seeking:
+                bits &= self.seeking
+            return bits
+
+
+class FacetIndex(object):
+    """Lazily built Facets for `model`, read in two queries: one over the
+    entities and one over their genre association table.
+
+    Like SearchEngine, it reloads when the data version returned by
+    `version` moved on without this process applying the change."""
+
+    def __init__(self, db, model, genres_table, genres_column, genre_model, seeking_column,
+                 version=None):
+        self.db = db
+        self.model = model
+        self.genres_table = genres_table
+        self.genres_column = genres_column
+        self.genre_model = genre_model
+        self.seeking_column = seeking_column
+        self.version = version or (lambda: None)
+        self.facets = None
+        self.facets_version = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        version = self.version()
+        with self.lock:
+            if self.facets is None or self.facets_version != version:
+                genres = defaultdict(list)
+                for entity_id, name in self.db.session.query(
+                        self.genres_column, self.genre_model.name).join(
+                        self.genre_model, self.genres_table.c.genre_id == self.genre_model.id):
+                    genres[entity_id].append(name)
+                facets = Facets()
+                for entity_id, city_id, seeking in self.db.session.query(
+                        self.model.id, self.model.city_id, self.seeking_column):
+                    facets.add(entity_id, genres.get(entity_id, ()), city_id, seeking)
+                self.facets = facets
+                self.facets_version = version
+            return self.facets
+
+    def ids(self, genres=(), match_all=True, city_id=None, seeking=False):
+        return bits_to_ids(self._load().match(genres, match_all, city_id, seeking))
+
+    def _follows(self, version):
+        if self.facets is None:
+            return False
+        if version is not None:
+            if self.facets_version not in (version - 1, version):
+                return False
+            self.facets_version = version
+        return True
+
+    def update(self, entity_id, genres, city_id, seeking, version=None):
+        with self.lock:
+            if self._follows(version):
+                self.facets.add(entity_id, genres, city_id, seeking)
+
+    def remove(self, entity_id, version=None):
+        with self.lock:
+            if self._follows(version):
+                self.facets.remove(entity_id)
+
+    def reset(self):
+        with self.lock:
+            self.facets = None
@@ -0,0 +1,264 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+import links
+
+# Fixed thumbnail boxes; images are scaled and centre-cropped to fill them
+SIZES = {
+    'thumb': (160, 160),
+    'tile': (400, 300),
+    'profile': (800, 600),
+}
+
+
+class ImageError(ValueError):
+    """A link that does not lead to an image we are willing to serve."""
+
+
+def fetch_image(url, timeout=5, max_bytes=10 * 1024 * 1024, opener=links.urlopen):
+    """Downloads `url`, refusing anything that is not an http(s) image of
+    at most `max_bytes` on a public address. Client errors raise
+    ImageError; network failures and server errors propagate so callers
+    can retry later."""
+    if not url.startswith(('http://', 'https://')):
+        raise ImageError('not an http(s) link')
+    request = urllib.request.Request(url, headers={'User-Agent': 'fyyur-image-proxy'})
+    try:
+        with opener(request, timeout=timeout) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith('image/'):
+                raise ImageError('served as %s' % content_type)
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise ImageError('%s bytes is over the %d limit' % (length, max_bytes))
+            data = response.read(max_bytes + 1)
+    except urllib.error.HTTPError as err:
+        if err.code >= 500:
+            raise
+        raise ImageError('answers %d' % err.code)
+    except links.UnsafeLinkError as err:
+        raise ImageError(str(err))
+    if len(data) > max_bytes:
+        raise ImageError('over the %d bytes limit' % max_bytes)
+    return data
+
+
+def render_thumbnail(data, size, max_pixels=50 * 1000 * 1000, quality=82):
+    """Scales and crops the encoded image `data` to exactly `size` and
+    returns it as a progressive JPEG."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width * image.height > max_pixels:
+                raise ImageError('%dx%d is too large to decode' % image.size)
+            # Lets the JPEG decoder downscale by up to 8x while decoding
+            image.draft('RGB', size)
+            image = ImageOps.exif_transpose(image)
+            image = ImageOps.fit(image, size, Image.LANCZOS)
+    except (OSError, Image.DecompressionBombError, SyntaxError) as err:
+        raise ImageError('not a readable image (%s)' % err)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+class DiskCache(object):
+    """Files under `directory` named by a hex key, evicting the least
+    recently used ones once they add up to more than `max_bytes`.
+
+    Blobs stored with `put_content` are keyed by the SHA-256 of their
+    bytes, so identical thumbnails are kept once. Recency survives restarts
+    through file modification times, which reads refresh.
+
+    Several processes may share the directory, so the in-memory listing
+    only knows about this process's writes. Before evicting, and at least
+    every `scan_interval` seconds of writes, it is rebuilt from disk."""
+
+    def __init__(self, directory, max_bytes, scan_interval=60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.scan_interval = scan_interval
+        self.entries = None
+        self.total = 0
+        self.scanned_at = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self):
+        if self.entries is None:
+            found = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith('.tmp'):
+                        continue
+                    try:
+                        info = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    found.append((info.st_mtime, name, info.st_size))
+            self.entries = OrderedDict((name, size) for _, name, size in sorted(found))
+            self.total = sum(self.entries.values())
+            self.scanned_at = time.monotonic()
+        return self.entries
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as handle:
+                data = handle.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self._forget(key)
+            return None
+        with self.lock:
+            entries = self._load()
+            if key in entries:
+                entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(temporary, 'wb') as handle:
+            handle.write(data)
+        os.replace(temporary, path)
+        with self.lock:
+            self._forget(key)
+            self._load()[key] = len(data)
+            self.total += len(data)
+            self._evict()
+        return key
+
+    def put_content(self, data):
+        return self.put(hashlib.sha256(data).hexdigest(), data)
+
+    def _forget(self, key):
+        size = self._load().pop(key, None)
+        if size is not None:
+            self.total -= size
+
+    def _evict(self):
+        if self.total <= self.max_bytes and \
+                time.monotonic() - self.scanned_at < self.scan_interval:
+            return
+        self.entries = None
+        self._load()
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            for key in list(self._load()):
+                try:
+                    os.remove(self.path(key))
+                except FileNotFoundError:
+                    pass
+            self.entries = OrderedDict()
+            self.total = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self._load()), 'bytes': self.total,
+                    'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class ImageProxy(object):
+    """Serves remote images as thumbnails kept in a DiskCache.
+
+    The first request for a link downloads it once and renders every size
+    in SIZES; each (link, size) pair then points at the content-addressed
+    thumbnail through a small reference entry. Links that failed are not
+    fetched again for `failure_ttl` seconds."""
+
+    def __init__(self, cache, fetch=fetch_image, sizes=SIZES, failure_ttl=300):
+        self.cache = cache
+        self.fetch = fetch
+        self.sizes = sizes
+        self.failure_ttl = failure_ttl
+        self.failures = {}
+        self.locks = [threading.Lock() for _ in range(32)]
+        self.hits = 0
+        self.fetches = 0
+
+    def reference(self, url, size):
+        return hashlib.sha256(('%s|%s' % (url, size)).encode()).hexdigest()
+
+    def cached(self, url, size):
+        """(digest, data) of the thumbnail if it is on disk, else None."""
+        reference = self.cache.get(self.reference(url, size))
+        if reference is None:
+            return None
+        digest = reference.decode()
+        data = self.cache.get(digest)
+        if data is None:
+            return None
+        self.hits += 1
+        return digest, data
+
+    def thumbnail(self, url, size):
+        """(digest, JPEG bytes) of `url` at `size`. Raises KeyError for an
+        unknown size and ImageError for links that are not images."""
+        if size not in self.sizes:
+            raise KeyError(size)
+        found = self.cached(url, size)
+        if found is not None:
+            return found
+        with self.locks[hash(url) % len(self.locks)]:
+            found = self.cached(url, size)
+            if found is not None:
+                return found
+            failure = self.failures.get(url)
+            if failure is not None and failure[0] > time.monotonic():
+                raise ImageError(failure[1])
+            self.fetches += 1
+            try:
+                rendered = self.render_all(url)
+            except ImageError as err:
+                self.failures[url] = (time.monotonic() + self.failure_ttl, str(err))
+                raise
+            self.failures.pop(url, None)
+            return rendered[size]
+
+    def render_all(self, url):
+        data = self.fetch(url)
+        rendered = {}
+        for name, box in self.sizes.items():
+            thumbnail = render_thumbnail(data, box)
+            digest = self.cache.put_content(thumbnail)
+            self.cache.put(self.reference(url, name), digest.encode())
+            rendered[name] = (digest, thumbnail)
+        return rendered
+
+    def warm(self, url):
+        """Fetches and renders `url` unless it is cached, for link checks."""
+        self.failures.pop(url, None)
+        self.thumbnail(url, next(iter(self.sizes)))
+
+    def stats(self):
+        return dict(self.cache.stats(), hits=self.hits, fetches=self.fetches,
+                    failing=len(self.failures))
@@ -0,0 +1,47 @@
+import csv
+import json
+
+
+def detect_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+def read_records(path, format=None):
+    """Yields one dict per CSV row or JSON line without reading the whole
+    file into memory."""
+    format = format or detect_format(path)
+    with open(path, newline='') as f:
+        if format == 'csv':
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def batched(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def split_list(value):
+    """Genres arrive as a JSON list or as a comma separated CSV cell."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [item.strip() for item in value if item and item.strip()]
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
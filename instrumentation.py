@@ -0,0 +1,103 @@
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement):
+    """Collapses literals and whitespace so repeated lazy loads that differ
+    only in their parameters count as the same statement."""
+    shape = re.sub(r"'[^']*'", '?', statement)
+    shape = re.sub(r'\b\d+\b', '?', shape)
+    return ' '.join(shape.split())
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def duplicates(self):
+        return {shape: count for shape, count in self.shapes.items() if count > 1}
+
+
+class QueryInstrumentation(object):
+    """Counts the queries, database time and repeated statement shapes of
+    every Flask request.
+
+    Results go out as X-DB-* response headers and a debug log line. With
+    SQL_STRICT_BUDGET on, a request issuing more than SQL_QUERY_BUDGET
+    queries raises QueryBudgetExceeded, which fails tests hitting it."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('SQL_INSTRUMENTATION', True)
+        app.config.setdefault('SQL_QUERY_BUDGET', None)
+        app.config.setdefault('SQL_STRICT_BUDGET', False)
+        if not app.config['SQL_INSTRUMENTATION']:
+            return
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(Engine, 'handle_error', self.handle_error)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def start(self):
+        g.sql_stats = RequestStats()
+
+    def current(self):
+        if has_request_context():
+            return g.get('sql_stats')
+        return None
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        stats = self.current()
+        if stats is not None:
+            stats.count += 1
+            stats.duration += time.perf_counter() - started
+            stats.shapes[statement_shape(statement)] += 1
+
+    def handle_error(self, context):
+        if context.connection is not None:
+            started = context.connection.info.get('query_started')
+            if started:
+                started.pop()
+
+    def finish(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        duplicates = stats.duplicates()
+        response.headers['X-DB-Query-Count'] = str(stats.count)
+        response.headers['X-DB-Time-ms'] = '%.1f' % (stats.duration * 1000)
+        response.headers['X-DB-Duplicate-Queries'] = str(
+            sum(duplicates.values()) - len(duplicates))
+        self.app.logger.debug('%s queries=%d db_time=%.1fms duplicates=%s',
+                              self.request_label(), stats.count,
+                              stats.duration * 1000, duplicates or '{}')
+
+        budget = self.app.config['SQL_QUERY_BUDGET']
+        if self.app.config['SQL_STRICT_BUDGET'] and budget is not None and stats.count > budget:
+            raise QueryBudgetExceeded('%s issued %d queries (budget %d)' % (
+                self.request_label(), stats.count, budget))
+        return response
+
+    def request_label(self):
+        return '%s %s' % (request.method, request.full_path.rstrip('?'))
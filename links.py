@@ -0,0 +1,82 @@
+import http.client
+import ipaddress
+import socket
+import urllib.request
+
+
+class UnsafeLinkError(ValueError):
+    """A link leading somewhere the server must not connect to."""
+
+
+# Hosts exempt from the address check, set from LINK_ALLOWED_HOSTS
+allowed_hosts = frozenset()
+
+
+def is_public(address):
+    address = ipaddress.ip_address(address.split('%', 1)[0])
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def public_address(host, port):
+    """Resolves `host` and returns its first address, refusing hosts that
+    resolve to any private, loopback, link-local, reserved or multicast
+    address, unless `host` is in allowed_hosts. Resolution failures raise
+    socket.gaierror."""
+    addresses = [info[4][0] for info in socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM)]
+    for address in addresses:
+        if host not in allowed_hosts and not is_public(address):
+            raise UnsafeLinkError('%s resolves to the non-public address %s' % (host, address))
+    return addresses[0]
+
+
+def create_public_connection(address, *args, **kwargs):
+    host, port = address
+    # Connects to the address that was checked, so a second lookup cannot
+    # swap in another one
+    return socket.create_connection((public_address(host, port), port), *args, **kwargs)
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = create_public_connection
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = create_public_connection
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+def public_opener():
+    """An opener that speaks only http(s), ignores proxy settings and
+    checks the address of every connection it makes, redirects included.
+    Links that lead elsewhere raise UnsafeLinkError or URLError."""
+    opener = urllib.request.OpenerDirector()
+    for handler in (PublicHTTPHandler(), PublicHTTPSHandler(),
+                    urllib.request.HTTPDefaultErrorHandler(),
+                    urllib.request.HTTPRedirectHandler(),
+                    urllib.request.HTTPErrorProcessor(),
+                    urllib.request.UnknownHandler()):
+        opener.add_handler(handler)
+    return opener
+
+
+urlopen = public_opener().open
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+
+class LookupCache(object):
+    """Bounded name -> id map for small reference tables.
+
+    Ids found or inserted inside a transaction are staged on the session and
+    only become visible to other requests once that session commits, so a
+    rolled back insert never leaves a dangling id behind."""
+
+    def __init__(self, name, max_entries=4096):
+        self.name = name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.warmed = False
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def warm(self, rows):
+        with self.lock:
+            if self.warmed:
+                return
+            self.warmed = True
+        for key, value in rows:
+            self.put(key, value)
+
+    def stage(self, session, key, value):
+        session.info.setdefault('staged_lookups', []).append(
+            (self, key, value))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.warmed = False
+
+
+def publish_staged(session):
+    for cache, key, value in session.info.pop('staged_lookups', []):
+        cache.put(key, value)
+
+
+def discard_staged(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('staged_lookups', None)
+
+
+def register_session_events(session):
+    event.listen(session, 'after_commit', publish_staged)
+    event.listen(session, 'after_transaction_end', discard_staged)
+
+
+def insert_ignore(session, table, rows, index_elements):
+    """INSERT rows, skipping those that collide with an existing unique key."""
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError('insert_ignore is not supported on ' + dialect)
+    session.execute(insert(table).on_conflict_do_nothing(
+        index_elements=index_elements), rows)
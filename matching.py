@@ -0,0 +1,143 @@
+import threading
+import time
+
+import numpy as np
+
+# Relative weight of each signal in a match score; every signal is scaled
+# to 0..1 first, so a perfect candidate scores 1.0
+WEIGHTS = {
+    'genre': 0.45,
+    'location': 0.25,
+    'history': 0.15,
+    'activity': 0.05,
+    'seeking': 0.10,
+}
+
+
+class CandidatePool(object):
+    """Column arrays over every candidate venue or artist, sorted by id.
+
+    `rows` are (id, city_id, state_id, seeking) tuples in id order,
+    `genre_pairs` (candidate_id, genre_id) tuples and `show_counts` a
+    mapping of candidate id to its number of shows."""
+
+    def __init__(self, rows, genre_pairs, show_counts, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.city_ids = np.array([-1 if row[1] is None else row[1] for row in rows], dtype=np.int64)
+        self.state_ids = np.array([-1 if row[2] is None else row[2] for row in rows], dtype=np.int64)
+        self.seeking = np.array([bool(row[3]) for row in rows], dtype=np.float64)
+
+        genre_ids = sorted({genre_id for _, genre_id in genre_pairs})
+        self.genre_columns = {genre_id: column for column, genre_id in enumerate(genre_ids)}
+        self.genres = np.zeros((len(self.ids), len(genre_ids)), dtype=np.uint8)
+        if genre_pairs:
+            pairs = np.array(genre_pairs, dtype=np.int64)
+            rows_at = self.positions(pairs[:, 0])
+            known = rows_at >= 0
+            columns = np.array([self.genre_columns[genre_id] for genre_id in pairs[:, 1]], dtype=np.int64)
+            self.genres[rows_at[known], columns[known]] = 1
+        self.genre_counts = self.genres.sum(axis=1, dtype=np.int64)
+
+        counts = np.zeros(len(self.ids), dtype=np.float64)
+        if show_counts:
+            shown = np.array(list(show_counts.items()), dtype=np.int64)
+            rows_at = self.positions(shown[:, 0])
+            counts[rows_at[rows_at >= 0]] = shown[rows_at >= 0, 1]
+        self.activity = np.log1p(counts) / np.log1p(counts.max()) if counts.size and counts.max() else counts
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        """Row of each id in `ids`, -1 for ids not in the pool."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(ids.shape, -1, dtype=np.int64)
+        rows = np.searchsorted(self.ids, ids)
+        rows = np.minimum(rows, len(self.ids) - 1)
+        return np.where(self.ids[rows] == ids, rows, -1)
+
+    def score(self, genre_ids, city_id, state_id, history):
+        """Scores every candidate against a target with `genre_ids`, located
+        in city_id/state_id, whose past shows per candidate id are
+        `history`. Returns an array aligned with `ids`."""
+        columns = [self.genre_columns[genre_id] for genre_id in genre_ids
+                   if genre_id in self.genre_columns]
+        if columns:
+            overlap = self.genres[:, columns].sum(axis=1, dtype=np.int64)
+        else:
+            overlap = np.zeros(len(self.ids), dtype=np.int64)
+        union = self.genre_counts + len(set(genre_ids)) - overlap
+        genre = np.divide(overlap, union, out=np.zeros(len(self.ids)), where=union > 0)
+
+        location = np.zeros(len(self.ids))
+        if state_id is not None:
+            location[self.state_ids == state_id] = 0.5
+        if city_id is not None:
+            location[self.city_ids == city_id] = 1.0
+
+        played = np.zeros(len(self.ids))
+        if history:
+            shown = np.array(list(history.items()), dtype=np.int64)
+            rows = self.positions(shown[:, 0])
+            played[rows[rows >= 0]] = shown[rows >= 0, 1]
+            played = np.log1p(played) / np.log1p(played.max()) if played.max() else played
+
+        return (WEIGHTS['genre'] * genre + WEIGHTS['location'] * location +
+                WEIGHTS['history'] * played + WEIGHTS['activity'] * self.activity +
+                WEIGHTS['seeking'] * self.seeking)
+
+    def top(self, scores, k):
+        """The k best (id, score) pairs, best first and ties broken by id.
+        Uses argpartition, so only the k winners are sorted."""
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.lexsort((self.ids[best], -scores[best]))]
+        return [(int(self.ids[row]), float(scores[row])) for row in best]
+
+
+class Matchmaker(object):
+    """Ranks candidates from a CandidatePool built by `load_pool(version)`.
+
+    The pool is rebuilt when the data version moved on, but at most once
+    every `max_stale` seconds, so bursts of writes do not trigger a rebuild
+    each. Results are cached per target under the pool's version."""
+
+    def __init__(self, name, load_pool, cache, max_stale=60):
+        self.name = name
+        self.load_pool = load_pool
+        self.cache = cache
+        self.max_stale = max_stale
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def current_pool(self, version):
+        with self.lock:
+            pool = self.pool
+            if pool is None or (pool.version != version and
+                                time.monotonic() - pool.built_at >= self.max_stale):
+                pool = self.pool = self.load_pool(version)
+            return pool
+
+    def recommend(self, target_id, load_target, version, k=10):
+        """Returns up to k (candidate_id, score) pairs for the target.
+        `load_target()` returns (genre_ids, city_id, state_id, history) or
+        None when the target does not exist."""
+        pool = self.current_pool(version)
+        key = 'match:%s:%s:%s:%d' % (self.name, pool.version, target_id, k)
+        matches = self.cache.get(key)
+        if matches is None:
+            target = load_target()
+            if target is None:
+                return None
+            matches = [list(match) for match in pool.top(pool.score(*target), k)]
+            self.cache.set(key, matches)
+        return matches
+
+    def reset(self):
+        with self.lock:
+            self.pool = None
@@ -0,0 +1,37 @@
+"""Add search text columns and trigram indexes.
+
+Revision ID: 3b8e5c1d2a47
+Revises: 57156c331c3e
+Create Date: 2026-10-18 10:12:44.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e5c1d2a47'
+down_revision = '57156c331c3e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('search_text', sa.String(), nullable=True))
+    op.add_column('artists', sa.Column('search_text', sa.String(), nullable=True))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_venues_search_text_trgm ON venues '
+                   'USING gin (search_text gin_trgm_ops)')
+        op.execute('CREATE INDEX ix_artists_search_text_trgm ON artists '
+                   'USING gin (search_text gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_artists_search_text_trgm')
+        op.execute('DROP INDEX IF EXISTS ix_venues_search_text_trgm')
+
+    op.drop_column('artists', 'search_text')
+    op.drop_column('venues', 'search_text')
@@ -0,0 +1,28 @@
+"""Unique names for states, cities and genres.
+
+Revision ID: 9d2f41c7e6b3
+Revises: 3b8e5c1d2a47
+Create Date: 2026-10-18 11:40:02.531870
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2f41c7e6b3'
+down_revision = '3b8e5c1d2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_unique_constraint('states_name_key', 'states', ['name'])
+    op.create_unique_constraint(
+        'cities_name_state_id_key', 'cities', ['name', 'state_id'])
+    op.create_unique_constraint('genres_name_key', 'genres', ['name'])
+
+
+def downgrade():
+    op.drop_constraint('genres_name_key', 'genres', type_='unique')
+    op.drop_constraint('cities_name_state_id_key', 'cities', type_='unique')
+    op.drop_constraint('states_name_key', 'states', type_='unique')
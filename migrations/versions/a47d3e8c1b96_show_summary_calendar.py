@@ -0,0 +1,35 @@
+"""Duration and venue city on show_summaries for calendar queries.
+
+Revision ID: a47d3e8c1b96
+Revises: f3c9d0b5a712
+Create Date: 2026-10-18 19:26:07.581930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a47d3e8c1b96'
+down_revision = 'f3c9d0b5a712'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('show_summaries', sa.Column('duration', sa.Integer(), nullable=True))
+    op.add_column('show_summaries', sa.Column('venue_city_id', sa.Integer(), nullable=True))
+    op.execute(
+        'UPDATE show_summaries SET '
+        'duration = (SELECT shows.duration FROM shows WHERE shows.id = show_summaries.id), '
+        'venue_city_id = (SELECT venues.city_id FROM venues '
+        'WHERE venues.id = show_summaries.venue_id)')
+    op.create_index('ix_show_summaries_venue_city_id_start_time', 'show_summaries',
+                    ['venue_city_id', 'start_time'])
+
+
+def downgrade():
+    op.drop_index('ix_show_summaries_venue_city_id_start_time',
+                  table_name='show_summaries')
+    op.drop_column('show_summaries', 'venue_city_id')
+    op.drop_column('show_summaries', 'duration')
@@ -0,0 +1,38 @@
+"""Shared data version row for cache keys and ETags.
+
+Revision ID: b62e0d9f4c18
+Revises: a47d3e8c1b96
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+import datetime
+import time
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b62e0d9f4c18'
+down_revision = 'a47d3e8c1b96'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    data_version = op.create_table(
+        'data_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('counter', sa.BigInteger(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(data_version, [{
+        'id': 1,
+        'counter': int(time.time() * 1000),
+        'changed_at': datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    }])
+
+
+def downgrade():
+    op.drop_table('data_version')
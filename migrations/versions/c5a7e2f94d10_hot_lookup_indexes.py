@@ -0,0 +1,45 @@
+"""Indexes for the hot lookup columns.
+
+Revision ID: c5a7e2f94d10
+Revises: 9d2f41c7e6b3
+Create Date: 2026-10-18 14:05:37.904126
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a7e2f94d10'
+down_revision = '9d2f41c7e6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_venue_id_start_time', 'shows',
+                    ['venue_id', 'start_time'])
+    op.create_index('ix_shows_artist_id_start_time', 'shows',
+                    ['artist_id', 'start_time'])
+    op.create_index('ix_shows_start_time_id', 'shows', ['start_time', 'id'])
+    op.create_index('ix_venues_city_id', 'venues', ['city_id'])
+    op.create_index('ix_artists_city_id', 'artists', ['city_id'])
+    op.create_index('ix_venue_genres_venue_id_genre_id', 'venue_genres',
+                    ['venue_id', 'genre_id'])
+    op.create_index('ix_venue_genres_genre_id', 'venue_genres', ['genre_id'])
+    op.create_index('ix_artist_genres_artist_id_genre_id', 'artist_genres',
+                    ['artist_id', 'genre_id'])
+    op.create_index('ix_artist_genres_genre_id', 'artist_genres', ['genre_id'])
+
+
+def downgrade():
+    op.drop_index('ix_artist_genres_genre_id', table_name='artist_genres')
+    op.drop_index('ix_artist_genres_artist_id_genre_id',
+                  table_name='artist_genres')
+    op.drop_index('ix_venue_genres_genre_id', table_name='venue_genres')
+    op.drop_index('ix_venue_genres_venue_id_genre_id',
+                  table_name='venue_genres')
+    op.drop_index('ix_artists_city_id', table_name='artists')
+    op.drop_index('ix_venues_city_id', table_name='venues')
+    op.drop_index('ix_shows_start_time_id', table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
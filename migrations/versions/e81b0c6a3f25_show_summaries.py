@@ -0,0 +1,55 @@
+"""Denormalized show_summaries read model.
+
+Revision ID: e81b0c6a3f25
+Revises: c5a7e2f94d10
+Create Date: 2026-10-18 16:52:18.660413
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b0c6a3f25'
+down_revision = 'c5a7e2f94d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_summaries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('venue_name', sa.String(), nullable=True),
+    sa.Column('venue_image_link', sa.String(length=500), nullable=True),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('artist_name', sa.String(), nullable=True),
+    sa.Column('artist_image_link', sa.String(length=500), nullable=True),
+    sa.ForeignKeyConstraint(['id'], ['shows.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_show_summaries_start_time_id', 'show_summaries',
+                    ['start_time', 'id'])
+    op.create_index('ix_show_summaries_venue_id_start_time', 'show_summaries',
+                    ['venue_id', 'start_time'])
+    op.create_index('ix_show_summaries_artist_id_start_time', 'show_summaries',
+                    ['artist_id', 'start_time'])
+
+    op.execute(
+        'INSERT INTO show_summaries (id, start_time, venue_id, venue_name, '
+        'venue_image_link, artist_id, artist_name, artist_image_link) '
+        'SELECT shows.id, shows.start_time, shows.venue_id, venues.name, '
+        'venues.image_link, shows.artist_id, artists.name, artists.image_link '
+        'FROM shows JOIN venues ON shows.venue_id = venues.id '
+        'JOIN artists ON shows.artist_id = artists.id')
+
+
+def downgrade():
+    op.drop_index('ix_show_summaries_artist_id_start_time',
+                  table_name='show_summaries')
+    op.drop_index('ix_show_summaries_venue_id_start_time',
+                  table_name='show_summaries')
+    op.drop_index('ix_show_summaries_start_time_id',
+                  table_name='show_summaries')
+    op.drop_table('show_summaries')
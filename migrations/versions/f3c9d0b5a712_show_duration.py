@@ -0,0 +1,36 @@
+"""Show durations and the venue double-booking constraint.
+
+Revision ID: f3c9d0b5a712
+Revises: e81b0c6a3f25
+Create Date: 2026-10-18 18:04:51.302746
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9d0b5a712'
+down_revision = 'e81b0c6a3f25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('shows', sa.Column('duration', sa.Integer(), nullable=False,
+                                     server_default='120'))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Fails if two existing shows at one venue already overlap; resolve
+        # those before upgrading
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.execute('ALTER TABLE shows ADD CONSTRAINT shows_no_overlap EXCLUDE '
+                   'USING gist (venue_id WITH =, tsrange(start_time, start_time + '
+                   'make_interval(mins => duration)) WITH &&)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE shows DROP CONSTRAINT IF EXISTS shows_no_overlap')
+
+    op.drop_column('shows', 'duration')
@@ -0,0 +1,117 @@
+import itertools
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class RoutingSession(Session):
+    """Session that sends reads of replica-eligible requests to a replica.
+
+    Flushes and explicit binds always go to the primary, as does anything
+    outside a request (CLI commands, migrations)."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            router = current_app.extensions.get('replica_router')
+            engine = router.read_engine() if router is not None else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter(object):
+    """Routes GET requests (and any endpoint listed in `read_endpoints`) to
+    healthy read replicas, round-robin.
+
+    Each replica is pinged at most every REPLICA_HEALTH_INTERVAL seconds and
+    skipped while its last ping failed; with no healthy replica reads fall
+    back to the primary. After a write the client gets a cookie that keeps
+    its reads on the primary for REPLICA_STICKY_SECONDS, so it sees its own
+    changes even if the replicas lag.
+
+    `last_write`, if given, returns when the data last changed (from any
+    client). For REPLICA_STICKY_SECONDS after that every read goes to the
+    primary, so pages and API responses cached under the new data version
+    are never filled from a replica that has not caught up yet."""
+
+    cookie_name = 'fyyur_primary_until'
+
+    def __init__(self, app=None, read_endpoints=(), last_write=None):
+        self.read_endpoints = set(read_endpoints)
+        self.last_write = last_write
+        self.engines = []
+        self.health = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DATABASE_REPLICA_URLS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        app.config.setdefault('REPLICA_HEALTH_INTERVAL', 10)
+        self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        self.health_interval = app.config['REPLICA_HEALTH_INTERVAL']
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.engines = [create_engine(url, **options)
+                        for url in app.config['DATABASE_REPLICA_URLS']]
+        self.cycle = itertools.cycle(self.engines)
+        app.extensions['replica_router'] = self
+        app.before_request(self.choose_role)
+        app.after_request(self.remember_write)
+
+    def is_read_request(self):
+        return request.method in ('GET', 'HEAD') or request.endpoint in self.read_endpoints
+
+    def choose_role(self):
+        g.db_replica = None
+        if not self.engines or not self.is_read_request():
+            return
+        primary_until = request.cookies.get(self.cookie_name, 0, type=float)
+        if primary_until > time.time():
+            return
+        if self.last_write is not None and \
+                time.time() - self.last_write().timestamp() < self.sticky_seconds:
+            return
+        g.db_replica = self.pick()
+
+    def remember_write(self, response):
+        if self.engines and not self.is_read_request() and response.status_code < 400:
+            response.set_cookie(self.cookie_name, str(time.time() + self.sticky_seconds),
+                                max_age=self.sticky_seconds, httponly=True)
+        return response
+
+    def read_engine(self):
+        if has_request_context():
+            return g.get('db_replica')
+        return None
+
+    def pick(self):
+        for _ in range(len(self.engines)):
+            with self.lock:
+                engine = next(self.cycle)
+            if self.healthy(engine):
+                return engine
+        return None
+
+    def healthy(self, engine):
+        checked, ok = self.health.get(engine, (0, True))
+        if time.monotonic() - checked < self.health_interval:
+            return ok
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+            ok = True
+        except SQLAlchemyError:
+            current_app.logger.warning('Replica %s failed its health check', engine.url)
+            ok = False
+        self.health[engine] = (time.monotonic(), ok)
+        return ok
+
+    def stats(self):
+        return [{'url': engine.url.render_as_string(hide_password=True),
+                 'healthy': self.health.get(engine, (0, True))[1],
+                 'pool': engine.pool.status()} for engine in self.engines]
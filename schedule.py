@@ -0,0 +1,189 @@
+import bisect
+import datetime
+import threading
+
+from sqlalchemy import DateTime, Integer, column, func, literal_column, values
+
+
+def show_end(start_time, duration):
+    return start_time + datetime.timedelta(minutes=duration)
+
+
+class IntervalIndex(object):
+    """Booked [start, end) intervals of one venue or artist.
+
+    Overlapping bookings are merged into disjoint blocks kept sorted by
+    start, so finding the bookings that overlap a new interval is a binary
+    search plus a walk over the (normally zero or one) blocks it touches.
+    Each block remembers the shows it was built from so conflicts can be
+    reported per show."""
+
+    def __init__(self):
+        self.starts = []
+        self.blocks = []
+        self.shows = {}
+
+    def __len__(self):
+        return len(self.shows)
+
+    def _touching(self, start, end):
+        first = bisect.bisect_right(self.starts, start) - 1
+        if first < 0 or self.blocks[first][1] <= start:
+            first += 1
+        last = bisect.bisect_left(self.starts, end)
+        return first, last
+
+    def overlapping(self, start, end, ignore=None):
+        first, last = self._touching(start, end)
+        found = []
+        for block in self.blocks[first:last]:
+            for show_id in block[2]:
+                show_start, show_stop = self.shows[show_id]
+                if show_id != ignore and show_start < end and start < show_stop:
+                    found.append(show_id)
+        return sorted(found, key=lambda show_id: self.shows[show_id])
+
+    def add(self, show_id, start, end):
+        if show_id in self.shows:
+            self.remove(show_id)
+        self.shows[show_id] = (start, end)
+        first, last = self._touching(start, end)
+        members = {show_id}
+        for block in self.blocks[first:last]:
+            start = min(start, block[0])
+            end = max(end, block[1])
+            members |= block[2]
+        self.starts[first:last] = [start]
+        self.blocks[first:last] = [(start, end, members)]
+
+    def remove(self, show_id):
+        interval = self.shows.pop(show_id, None)
+        if interval is None:
+            return
+        position = bisect.bisect_right(self.starts, interval[0]) - 1
+        members = self.blocks[position][2] - {show_id}
+        del self.starts[position]
+        del self.blocks[position]
+        for member in members:
+            self.add(member, *self.shows.pop(member))
+
+
+class ScheduleChecker(object):
+    """Finds shows overlapping a booking of one venue, or of whatever else
+    `column` (by default the model's venue_id) groups shows by.
+
+    On PostgreSQL the lookup runs against the database; for venues it uses
+    the GiST index backing the shows_no_overlap exclusion constraint, which
+    also rejects any double booking that slips past the check. Other
+    databases fall back to a lazily loaded IntervalIndex per key, kept in
+    step with committed
+    changes. Like SearchEngine, the loaded indexes are dropped when the data
+    version returned by `version` moved on without this process applying
+    the change."""
+
+    def __init__(self, db, model, version=None, column=None):
+        self.db = db
+        self.model = model
+        self.column = model.venue_id if column is None else column
+        self.version = version or (lambda: None)
+        self.indexes = {}
+        # Key of the loaded index holding each show, so moving a show only
+        # touches the index it leaves
+        self.keys = {}
+        self.indexes_version = None
+        self.lock = threading.Lock()
+
+    def uses_database(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def conflicts(self, key, start, end, ignore=None):
+        """Ids of the shows booked for `key` overlapping [start, end)."""
+        return self.conflicts_many([(key, start, end)], ignore)[0]
+
+    def conflicts_many(self, bookings, ignore=None):
+        """Checks (key, start, end) bookings against the stored shows
+        in one pass and returns a list of conflicting show ids per booking.
+        Bookings are not checked against each other."""
+        if not bookings:
+            return []
+        if self.uses_database():
+            return self._conflicts_database(bookings, ignore)
+        results = []
+        version = self.version()
+        with self.lock:
+            if self.indexes_version != version:
+                self.indexes = {}
+                self.keys = {}
+                self.indexes_version = version
+            for key, start, end in bookings:
+                results.append(self._load_index(key).overlapping(start, end, ignore))
+        return results
+
+    def booked_range(self):
+        # Spelled exactly like the exclusion constraint so the planner can
+        # use its index
+        table = self.model.__table__.name
+        return literal_column(
+            'tsrange(%s.start_time, %s.start_time + make_interval(mins => %s.duration))'
+            % (table, table, table))
+
+    def _conflicts_database(self, bookings, ignore):
+        model = self.model
+        wanted = values(column('position', Integer), column('key', Integer),
+                        column('lower', DateTime), column('upper', DateTime),
+                        name='wanted').data(
+            [(position,) + tuple(booking) for position, booking in enumerate(bookings)])
+        query = self.db.session.query(wanted.c.position, model.id).join(
+            model, self.column == wanted.c.key).filter(
+            self.booked_range().op('&&')(func.tsrange(wanted.c.lower, wanted.c.upper)))
+        if ignore is not None:
+            query = query.filter(model.id != ignore)
+        results = [[] for _ in bookings]
+        for position, show_id in query.order_by(model.start_time, model.id):
+            results[position].append(show_id)
+        return results
+
+    def _load_index(self, key):
+        index = self.indexes.get(key)
+        if index is None:
+            index = IntervalIndex()
+            for show_id, start, duration in self.db.session.query(
+                    self.model.id, self.model.start_time, self.model.duration).filter(
+                    self.column == key):
+                index.add(show_id, start, show_end(start, duration))
+                self.keys[show_id] = key
+            self.indexes[key] = index
+        return index
+
+    def _follows(self, version):
+        if version is not None:
+            if self.indexes_version not in (version - 1, version):
+                return False
+            self.indexes_version = version
+        return True
+
+    def update(self, show_id, key, start, duration, version=None):
+        with self.lock:
+            if not self._follows(version):
+                return
+            previous = self.keys.pop(show_id, None)
+            if previous is not None and previous != key:
+                self.indexes[previous].remove(show_id)
+            index = self.indexes.get(key)
+            if index is not None:
+                index.add(show_id, start, show_end(start, duration))
+                self.keys[show_id] = key
+
+    def remove(self, show_id, key, version=None):
+        with self.lock:
+            if not self._follows(version):
+                return
+            key = self.keys.pop(show_id, key)
+            index = self.indexes.get(key)
+            if index is not None:
+                index.remove(show_id)
+
+    def reset(self):
+        with self.lock:
+            self.indexes = {}
+            self.keys = {}
@@ -0,0 +1,169 @@
+import re
+import threading
+from collections import defaultdict
+
+from sqlalchemy import func
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'\w+', (text or '').lower()))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(object):
+    """In-process inverted index from trigrams to document ids.
+
+    Used when the database has no trigram support (SQLite, tests). Matching
+    keeps the ILIKE semantics of the original search: every word of the
+    query has to appear somewhere in the document."""
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def add(self, doc_id, text):
+        with self.lock:
+            self._remove(doc_id)
+            text = ' %s ' % normalize(text)
+            self.documents[doc_id] = text
+            for gram in trigrams(text):
+                self.postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        text = self.documents.pop(doc_id, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            self.postings[gram].discard(doc_id)
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def search(self, term):
+        words = normalize(term).split()
+        with self.lock:
+            candidates = None
+            for word in words:
+                grams = trigrams(word)
+                if not grams:
+                    continue
+                for gram in grams:
+                    ids = self.postings.get(gram, set())
+                    candidates = ids if candidates is None else candidates & ids
+            if candidates is None:
+                candidates = self.documents.keys()
+
+            ranked = []
+            for doc_id in candidates:
+                text = self.documents[doc_id]
+                positions = [text.find(word) for word in words]
+                if -1 not in positions:
+                    ranked.append((sum(positions), doc_id))
+        ranked.sort()
+        return [doc_id for _, doc_id in ranked]
+
+
+class SearchEngine(object):
+    """Ranked, paginated search over `model.<column>`.
+
+    On PostgreSQL the query runs against a pg_trgm GIN index and returns
+    the total count alongside the page through a window function. Other
+    databases fall back to a lazily built TrigramIndex.
+
+    `version`, if given, returns the current data version. The index is
+    rebuilt when it moved on without this process applying the change, so
+    writes made by other processes show up too."""
+
+    def __init__(self, db, model, column, version=None):
+        self.db = db
+        self.model = model
+        self.column = column
+        self.version = version or (lambda: None)
+        self.index = None
+        self.index_version = None
+        self.lock = threading.Lock()
+
+    def uses_database(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def search(self, term, limit=None, offset=0, within=None):
+        """Returns (total, page). `within`, if given, is a collection of ids
+        the results are restricted to."""
+        if self.uses_database():
+            return self._search_database(term, limit, offset, within)
+        return self._search_index(term, limit, offset, within)
+
+    def _search_database(self, term, limit, offset, within):
+        words = normalize(term).split()
+        query = self.db.session.query(self.model, func.count().over()).filter(
+            *[self.column.ilike(f'%{word}%') for word in words])
+        if within is not None:
+            query = query.filter(self.model.id.in_(within))
+        if words:
+            query = query.order_by(
+                func.similarity(self.column, ' '.join(words)).desc())
+        rows = query.order_by(self.model.id).limit(limit).offset(offset).all()
+        if rows:
+            count = rows[0][1]
+        elif offset:
+            # A page past the last match carries no window count
+            count = query.with_entities(func.count(self.model.id)).order_by(None).scalar()
+        else:
+            count = 0
+        return count, [row[0] for row in rows]
+
+    def _search_index(self, term, limit, offset, within):
+        ids = self._load_index().search(term)
+        if within is not None:
+            within = set(within)
+            ids = [doc_id for doc_id in ids if doc_id in within]
+        page = ids[offset:None if limit is None else offset + limit]
+        if not page:
+            return len(ids), []
+        found = {item.id: item for item in self.model.query.filter(
+            self.model.id.in_(page)).all()}
+        return len(ids), [found[i] for i in page if i in found]
+
+    def _load_index(self):
+        version = self.version()
+        with self.lock:
+            if self.index is None or self.index_version != version:
+                index = TrigramIndex()
+                for doc_id, text in self.db.session.query(
+                        self.model.id, self.column):
+                    index.add(doc_id, text)
+                self.index = index
+                self.index_version = version
+            return self.index
+
+    def _follows(self, version):
+        # A committed change moves the index to `version` only if it was
+        # current just before; otherwise the next search rebuilds it
+        if self.index is None:
+            return False
+        if version is not None:
+            if self.index_version not in (version - 1, version):
+                return False
+            self.index_version = version
+        return True
+
+    def update(self, doc_id, text, version=None):
+        with self.lock:
+            if self._follows(version):
+                self.index.add(doc_id, text)
+
+    def remove(self, doc_id, version=None):
+        with self.lock:
+            if self._follows(version):
+                self.index.remove(doc_id)
+
+    def reset(self):
+        with self.lock:
+            self.index = None
@@ -0,0 +1,271 @@
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class Job(object):
+
+    def __init__(self, name, args, kwargs, attempts=0, run_at=None, id=None):
+        self.id = id
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = attempts
+        self.run_at = time.time() if run_at is None else run_at
+
+    def payload(self):
+        return json.dumps({'args': self.args, 'kwargs': self.kwargs})
+
+    def __repr__(self):
+        return '<Job %s(%s) attempt %d>' % (self.name, self.id, self.attempts)
+
+
+class MemoryStore(object):
+    """Process-local queue ordered by run time; jobs are lost on exit."""
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count(1)
+        self.failed = []
+        self.condition = threading.Condition()
+
+    def put(self, job):
+        with self.condition:
+            if job.id is None:
+                job.id = next(self.counter)
+            heapq.heappush(self.heap, (job.run_at, job.id, job))
+            self.condition.notify()
+
+    def claim(self, timeout=1.0):
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.heap and self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)[2]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self.heap:
+                    wait = min(wait, self.heap[0][0] - now)
+                self.condition.wait(wait)
+
+    def retry(self, job, error):
+        self.put(job)
+
+    def done(self, job):
+        pass
+
+    def fail(self, job, error):
+        with self.condition:
+            self.failed.append((job.id, job.name, error))
+
+    def stats(self):
+        with self.condition:
+            return {'store': 'memory', 'queued': len(self.heap), 'failed': len(self.failed)}
+
+
+class SQLiteStore(object):
+    """Queue persisted in a SQLite file, shared by every process pointing at
+    it, so `flask worker` can drain jobs that web processes enqueued.
+
+    Claiming a job is a single UPDATE ... RETURNING inside an immediate
+    transaction, so two workers never pick the same job. Jobs left
+    'running' by a crashed worker are requeued by `requeue_stale`."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self.connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, '
+                'payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                'run_at REAL NOT NULL, status TEXT NOT NULL, error TEXT, '
+                'updated_at REAL NOT NULL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS ix_tasks_status_run_at ON tasks (status, run_at)')
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = connection
+        return connection
+
+    def put(self, job):
+        now = time.time()
+        connection = self.connect()
+        if job.id is None:
+            job.id = connection.execute(
+                "INSERT INTO tasks (name, payload, attempts, run_at, status, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job.name, job.payload(), job.attempts, job.run_at, now)).lastrowid
+        else:
+            connection.execute(
+                "UPDATE tasks SET attempts = ?, run_at = ?, status = 'queued', updated_at = ? "
+                "WHERE id = ?", (job.attempts, job.run_at, now, job.id))
+
+    def claim(self, timeout=1.0, poll=0.2):
+        deadline = time.time() + timeout
+        connection = self.connect()
+        while True:
+            now = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(
+                    "UPDATE tasks SET status = 'running', updated_at = ? WHERE id = ("
+                    "SELECT id FROM tasks WHERE status = 'queued' AND run_at <= ? "
+                    "ORDER BY run_at, id LIMIT 1) "
+                    "RETURNING id, name, payload, attempts, run_at", (now, now)).fetchone()
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            if row is not None:
+                payload = json.loads(row[2])
+                return Job(row[1], payload['args'], payload['kwargs'], row[3], row[4], row[0])
+            if now >= deadline:
+                return None
+            time.sleep(min(poll, max(deadline - now, 0)))
+
+    def retry(self, job, error):
+        self.connect().execute(
+            "UPDATE tasks SET attempts = ?, run_at = ?, status = 'queued', error = ?, "
+            "updated_at = ? WHERE id = ?", (job.attempts, job.run_at, error, time.time(), job.id))
+
+    def done(self, job):
+        self.connect().execute('DELETE FROM tasks WHERE id = ?', (job.id,))
+
+    def fail(self, job, error):
+        self.connect().execute(
+            "UPDATE tasks SET attempts = ?, status = 'failed', error = ?, updated_at = ? "
+            "WHERE id = ?", (job.attempts, error, time.time(), job.id))
+
+    def requeue_stale(self, older_than):
+        return self.connect().execute(
+            "UPDATE tasks SET status = 'queued', updated_at = ? "
+            "WHERE status = 'running' AND updated_at < ?",
+            (time.time(), time.time() - older_than)).rowcount
+
+    def stats(self):
+        counts = dict(self.connect().execute(
+            'SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+        return {'store': 'sqlite', 'queued': counts.get('queued', 0),
+                'running': counts.get('running', 0), 'failed': counts.get('failed', 0)}
+
+
+class TaskQueue(object):
+    """Runs registered functions outside the request that enqueued them.
+
+    TASK_QUEUE picks the store: 'memory' (in-process only), 'sqlite'
+    (persistent, at TASK_QUEUE_PATH, shared with `flask worker`) or 'eager'
+    (run inline, for tests). TASK_WORKERS threads start in the web process
+    on the first enqueue. A failing job is retried with exponential backoff
+    from TASK_RETRY_DELAY seconds, capped at TASK_RETRY_MAX_DELAY, until it
+    has run TASK_MAX_ATTEMPTS times."""
+
+    def __init__(self, app=None):
+        self.registry = {}
+        self.threads = []
+        self.lock = threading.Lock()
+        self.counts = {'processed': 0, 'retried': 0, 'failed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('TASK_QUEUE', 'memory')
+        app.config.setdefault('TASK_QUEUE_PATH', os.path.join(app.instance_path, 'tasks.db'))
+        app.config.setdefault('TASK_WORKERS', 2)
+        app.config.setdefault('TASK_MAX_ATTEMPTS', 5)
+        app.config.setdefault('TASK_RETRY_DELAY', 2.0)
+        app.config.setdefault('TASK_RETRY_MAX_DELAY', 300.0)
+        self.mode = app.config['TASK_QUEUE']
+        self.workers = app.config['TASK_WORKERS']
+        self.max_attempts = app.config['TASK_MAX_ATTEMPTS']
+        self.retry_delay = app.config['TASK_RETRY_DELAY']
+        self.retry_max_delay = app.config['TASK_RETRY_MAX_DELAY']
+        if self.mode == 'sqlite':
+            directory = os.path.dirname(app.config['TASK_QUEUE_PATH'])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.store = SQLiteStore(app.config['TASK_QUEUE_PATH'])
+        else:
+            self.store = MemoryStore()
+        app.extensions['task_queue'] = self
+
+    def task(self, func):
+        """Registers `func` as a task; `func.delay(...)` enqueues a call.
+        Arguments must be JSON serializable."""
+        self.registry[func.__name__] = func
+        func.delay = lambda *args, **kwargs: self.enqueue(func.__name__, *args, **kwargs)
+        return func
+
+    def enqueue(self, name, *args, **kwargs):
+        job = Job(name, list(args), kwargs)
+        if self.mode == 'eager':
+            self.run(job, retry=False)
+            return job
+        self.store.put(job)
+        if self.workers:
+            self.start_workers(self.workers)
+        return job
+
+    def run(self, job, retry=True):
+        job.attempts += 1
+        try:
+            with self.app.app_context():
+                self.registry[job.name](*job.args, **job.kwargs)
+        except Exception as err:
+            error = '%s: %s' % (type(err).__name__, err)
+            if retry and job.attempts < self.max_attempts:
+                delay = min(self.retry_delay * 2 ** (job.attempts - 1), self.retry_max_delay)
+                job.run_at = time.time() + delay
+                self.app.logger.warning('%r failed (%s), retrying in %.1fs', job, error, delay)
+                self.store.retry(job, error)
+                self.count('retried')
+            else:
+                self.app.logger.error('%r failed for good: %s', job, error)
+                self.store.fail(job, error)
+                self.count('failed')
+            return False
+        self.store.done(job)
+        self.count('processed')
+        return True
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def work(self, stop=None, burst=False):
+        """Claims and runs jobs until `stop` is set, or, with `burst`, until
+        the queue has nothing ready."""
+        while stop is None or not stop.is_set():
+            job = self.store.claim(timeout=0 if burst else 1.0)
+            if job is None:
+                if burst:
+                    return
+                continue
+            self.run(job)
+
+    def start_workers(self, count):
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < count:
+                thread = threading.Thread(target=self.work, daemon=True,
+                                          name='task-worker-%d' % (len(self.threads) + 1))
+                thread.start()
+                self.threads.append(thread)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts, mode=self.mode,
+                         workers=sum(thread.is_alive() for thread in self.threads))
+        stats.update(self.store.stats())
+        return stats
@@ -0,0 +1,48 @@
+"""Shared setup for tests that drive the app. Importing this module picks
+the testing profile and points the database and caches at a scratch
+directory, so it has to come before any import of app or config."""
+import atexit
+import os
+import shutil
+import tempfile
+
+SCRATCH = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, SCRATCH, True)
+os.environ['FYYUR_ENV'] = 'testing'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(SCRATCH, 'test.db')
+os.environ['IMAGE_CACHE_DIR'] = os.path.join(SCRATCH, 'images')
+
+import app as fyyur  # noqa: E402
+import benchmark  # noqa: E402
+import importer  # noqa: E402
+
+
+def resetDatabase():
+    db = fyyur.db
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    fyyur.clearLookupCaches()
+    for engine in fyyur.search_engines.values():
+        engine.reset()
+    for index in fyyur.facet_indexes.values():
+        index.reset()
+    fyyur.schedule.reset()
+    fyyur.artist_schedule.reset()
+
+
+def loadCatalog(venues=40, artists=40, shows=300):
+    """Recreates the database holding a synthetic catalog. Needs an app
+    context."""
+    db = fyyur.db
+    resetDatabase()
+    catalog = benchmark.SyntheticCatalog(seed=1)
+    fyyur.importVenueOrArtistBatch(fyyur.Venue, fyyur.VenueGenres, list(catalog.venues(venues)))
+    fyyur.importVenueOrArtistBatch(fyyur.Artist, fyyur.ArtistGenres, list(catalog.artists(artists)))
+    venue_ids = [row[0] for row in db.session.query(fyyur.Venue.id)]
+    artist_ids = [row[0] for row in db.session.query(fyyur.Artist.id)]
+    for batch in importer.batched(catalog.shows(shows, venue_ids, artist_ids), 1000):
+        fyyur.importShowBatch(batch)
+        db.session.commit()
+    fyyur.refreshShowSummaries()
+    db.session.remove()
@@ -0,0 +1,22 @@
+import unittest
+
+from support import fyyur, resetDatabase
+
+
+class BenchmarkCommandTest(unittest.TestCase):
+
+    def tearDown(self):
+        with fyyur.app.app_context():
+            resetDatabase()
+
+    def test_loads_shows_in_several_batches(self):
+        runner = fyyur.app.test_cli_runner()
+        result = runner.invoke(args=['benchmark', '--venues', '40', '--artists', '40',
+                                     '--shows', '20001', '--requests', '1'])
+        self.assertIsNone(result.exception, result.output)
+        self.assertIn('Loaded 40 venues, 40 artists, 20001 shows', result.output)
+        self.assertIn('POST /shows/create', result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import datetime
+import unittest
+
+from support import fyyur, loadCatalog
+
+from exporter import ical_escape, ical_fold
+
+
+class IcalFoldTest(unittest.TestCase):
+
+    def test_short_lines_are_kept(self):
+        self.assertEqual(ical_fold('SUMMARY:Jazz night'), 'SUMMARY:Jazz night\r\n')
+        self.assertEqual(ical_fold('X' * 75), 'X' * 75 + '\r\n')
+
+    def test_long_lines_fold_at_75_octets(self):
+        folded = ical_fold('DESCRIPTION:' + 'a' * 200)
+        lines = folded[:-2].split('\r\n')
+        self.assertEqual(len(lines[0].encode('utf-8')), 75)
+        for line in lines[1:]:
+            self.assertTrue(line.startswith(' '))
+            self.assertLessEqual(len(line.encode('utf-8')), 75)
+        self.assertEqual(''.join([lines[0]] + [line[1:] for line in lines[1:]]),
+                         'DESCRIPTION:' + 'a' * 200)
+
+    def test_multibyte_characters_are_not_split(self):
+        line = 'LOCATION:' + 'é' * 100
+        folded = ical_fold(line)
+        pieces = folded[:-2].split('\r\n')
+        for piece in pieces:
+            self.assertLessEqual(len(piece.encode('utf-8')), 75)
+        self.assertEqual(pieces[0] + ''.join(piece[1:] for piece in pieces[1:]), line)
+
+    def test_escape(self):
+        self.assertEqual(ical_escape('a,b;c\\d\ne'), 'a\\,b\\;c\\\\d\\ne')
+
+
+class CalendarTest(unittest.TestCase):
+
+    def setUp(self):
+        with fyyur.app.app_context():
+            loadCatalog(venues=2, artists=2, shows=0)
+            for artist_id, start in ((1, datetime.datetime(2040, 3, 1, 18)),
+                                     (2, datetime.datetime(2040, 3, 1, 21)),
+                                     (1, datetime.datetime(2040, 3, 3, 18))):
+                fyyur.db.session.add(fyyur.Show(venue_id=1, artist_id=artist_id,
+                                                start_time=start, duration=120))
+            fyyur.db.session.commit()
+        self.client = fyyur.app.test_client()
+
+    def test_counts_per_day(self):
+        response = self.client.get('/api/v1/calendar?from=2040-03-01&to=2040-03-05')
+        self.assertEqual(response.status_code, 200)
+        counts = [day['count'] for day in response.get_json()['data']]
+        self.assertEqual(counts, [2, 0, 1, 0, 0])
+
+    def test_invalid_range(self):
+        self.assertEqual(self.client.get('/api/v1/calendar?from=someday').status_code, 400)
+
+    def test_venue_feed(self):
+        response = self.client.get('/venues/1/shows.ics')
+        self.assertEqual(response.mimetype, 'text/calendar')
+        body = response.get_data(as_text=True)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 3)
+        self.assertIn('DTSTART:20400301T180000', body)
+        self.assertEqual(self.client.get('/venues/99/shows.ics').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from facets import Facets, bits_to_ids
+
+
+class FacetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.facets = Facets()
+        self.facets.add(1, ['Jazz', 'Blues'], 10, True)
+        self.facets.add(2, ['jazz'], 20, False)
+        self.facets.add(3, ['Rock'], 10, True)
+        self.facets.add(130, ['Blues', 'Rock'], None, False)
+
+    def ids(self, **filters):
+        return bits_to_ids(self.facets.match(**filters))
+
+    def test_bits_to_ids(self):
+        self.assertEqual(bits_to_ids(0), [])
+        self.assertEqual(bits_to_ids(0b10110), [1, 2, 4])
+        self.assertEqual(bits_to_ids(1 << 200), [200])
+
+    def test_no_filters_match_everything(self):
+        self.assertEqual(self.ids(), [1, 2, 3, 130])
+
+    def test_genres_all_and_any(self):
+        self.assertEqual(self.ids(genres=['JAZZ']), [1, 2])
+        self.assertEqual(self.ids(genres=['blues', 'rock']), [130])
+        self.assertEqual(self.ids(genres=['blues', 'rock'], match_all=False), [1, 3, 130])
+        self.assertEqual(self.ids(genres=['polka']), [])
+
+    def test_city_and_seeking(self):
+        self.assertEqual(self.ids(city_id=10), [1, 3])
+        self.assertEqual(self.ids(city_id=10, genres=['rock']), [3])
+        self.assertEqual(self.ids(seeking=True), [1, 3])
+        self.assertEqual(self.ids(city_id=99), [])
+
+    def test_update_replaces_facets(self):
+        self.facets.add(1, ['Rock'], 20, False)
+        self.assertEqual(self.ids(genres=['jazz']), [2])
+        self.assertEqual(self.ids(genres=['rock']), [1, 3, 130])
+        self.assertEqual(self.ids(city_id=20), [1, 2])
+        self.assertEqual(self.ids(seeking=True), [3])
+
+    def test_remove(self):
+        self.facets.remove(130)
+        self.facets.remove(130)
+        self.assertEqual(self.ids(), [1, 2, 3])
+        self.assertEqual(self.ids(genres=['blues']), [1])
+        self.facets.remove(2)
+        self.assertEqual(self.ids(genres=['jazz']), [1])
+        self.assertNotIn(20, self.facets.cities)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from support import fyyur, loadCatalog
+
+from images import DiskCache, ImageError, render_thumbnail
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = DiskCache(self.directory, max_bytes=10)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('aa01', b'1111')
+        self.cache.put('bb02', b'2222')
+        os.utime(self.cache.path('aa01'), (1, 1))
+        os.utime(self.cache.path('bb02'), (2, 2))
+        self.assertEqual(self.cache.get('aa01'), b'1111')
+        self.cache.put('cc03', b'3333')
+        self.assertIsNone(self.cache.get('bb02'))
+        self.assertEqual(self.cache.get('aa01'), b'1111')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 8)
+
+    def test_content_is_stored_once(self):
+        key = self.cache.put_content(b'same')
+        self.assertEqual(self.cache.put_content(b'same'), key)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+
+def pngBytes():
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 30, 30)).save(output, 'PNG')
+    return output.getvalue()
+
+
+class ImageProxyTest(unittest.TestCase):
+
+    link = 'https://images.example.com/venue.png'
+
+    def setUp(self):
+        with fyyur.app.app_context():
+            loadCatalog(venues=2, artists=2, shows=2)
+            venue = fyyur.db.session.get(fyyur.Venue, 1)
+            venue.image_link = self.link
+            fyyur.db.session.commit()
+        fyyur.image_proxy.cache.clear()
+        fyyur.image_proxy.failures.clear()
+        self.client = fyyur.app.test_client()
+
+    def test_is_known_image(self):
+        with fyyur.app.app_context():
+            self.assertTrue(fyyur.isKnownImage(self.link))
+            self.assertFalse(fyyur.isKnownImage('https://elsewhere.example.com/x.png'))
+
+    def test_unknown_links_are_not_fetched(self):
+        with mock.patch.object(fyyur.image_proxy, 'fetch') as fetch:
+            response = self.client.get('/images/thumb', query_string={
+                'url': 'http://169.254.169.254/latest/meta-data'})
+        self.assertEqual(response.status_code, 404)
+        fetch.assert_not_called()
+
+    def test_known_link_is_served_as_thumbnail(self):
+        with mock.patch.object(fyyur.image_proxy, 'fetch', return_value=pngBytes()) as fetch:
+            first = self.client.get('/images/thumb', query_string={'url': self.link})
+            second = self.client.get('/images/tile', query_string={'url': self.link})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.mimetype, 'image/jpeg')
+        with Image.open(io.BytesIO(second.data)) as image:
+            self.assertEqual(image.size, (400, 300))
+        fetch.assert_called_once_with(self.link)
+
+    def test_unreadable_image_is_refused(self):
+        with self.assertRaises(ImageError):
+            render_thumbnail(b'not an image', (160, 160))
+
+
+if __name__ == '__main__':
+    unittest.main()
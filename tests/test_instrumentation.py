@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+from support import fyyur, loadCatalog
+
+from instrumentation import QueryBudgetExceeded, statement_shape
+
+
+class StatementShapeTest(unittest.TestCase):
+
+    def test_literals_collapse(self):
+        self.assertEqual(statement_shape("SELECT * FROM shows WHERE id = 12 AND name = 'x'"),
+                         statement_shape("SELECT *  FROM shows\nWHERE id = 7 AND name = 'y'"))
+
+
+class QueryBudgetTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with fyyur.app.app_context():
+            loadCatalog()
+
+    def setUp(self):
+        self.client = fyyur.app.test_client()
+
+    def test_testing_profile_is_strict(self):
+        self.assertTrue(fyyur.app.config['SQL_STRICT_BUDGET'])
+        self.assertEqual(fyyur.app.config['SQL_QUERY_BUDGET'], 25)
+
+    def test_pages_stay_within_budget(self):
+        for path in ('/', '/venues', '/artists', '/shows', '/venues/1', '/artists/1',
+                     '/api/v1/shows'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertLessEqual(int(response.headers['X-DB-Query-Count']), 25, path)
+        response = self.client.post('/venues/search', data={'search_term': 'venue'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_request_over_budget_fails(self):
+        with mock.patch.dict(fyyur.app.config, SQL_QUERY_BUDGET=0):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/venues')
+
+
+if __name__ == '__main__':
+    unittest.main()
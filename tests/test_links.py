@@ -0,0 +1,108 @@
+import http.server
+import io
+import threading
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from support import fyyur, loadCatalog
+
+import links
+
+
+def pngBytes():
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 30, 30)).save(output, 'PNG')
+    return output.getvalue()
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Plays the remote sites: /ok answers 200, /venue.png serves an image
+    and everything else is missing. Every request path is recorded."""
+
+    pages = {'/ok': ('text/html', b'<p>ok</p>'), '/venue.png': ('image/png', pngBytes())}
+
+    def do_GET(self, body=True):
+        self.server.requests.append((self.command, self.path))
+        found = self.pages.get(self.path)
+        if found is None:
+            self.send_error(404)
+            return
+        content_type, data = found
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LinkCheckTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.server.requests = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests.clear()
+        fyyur.image_proxy.cache.clear()
+        fyyur.image_proxy.failures.clear()
+        with fyyur.app.app_context():
+            loadCatalog(venues=2, artists=2, shows=0)
+            venue = fyyur.db.session.get(fyyur.Venue, 1)
+            venue.image_link = self.base + '/venue.png'
+            venue.website = self.base + '/ok'
+            venue.facebook_link = self.base + '/gone'
+            fyyur.db.session.commit()
+        self.config = mock.patch.dict(fyyur.app.config, LINK_CHECKS=True)
+        self.config.start()
+        self.addCleanup(self.config.stop)
+
+    def checkLinks(self):
+        with fyyur.app.app_context():
+            with self.assertLogs(fyyur.app.logger, 'WARNING') as logged:
+                fyyur.checkLinks('venues', 1)
+        return logged.output
+
+    def test_allowlist_is_testing_only(self):
+        self.assertEqual(fyyur.app.config['LINK_ALLOWED_HOSTS'], ['127.0.0.1'])
+        self.assertEqual(links.allowed_hosts, {'127.0.0.1'})
+        with mock.patch.object(links, 'allowed_hosts', frozenset()):
+            with self.assertRaises(links.UnsafeLinkError):
+                links.public_address('127.0.0.1', 80)
+
+    def test_only_broken_links_are_reported(self):
+        output = self.checkLinks()
+        self.assertEqual(len(output), 1)
+        self.assertIn('facebook_link %s/gone answers 404' % self.base, output[0])
+        self.assertIn(('HEAD', '/ok'), self.server.requests)
+
+    def test_image_link_is_fetched_once_and_served(self):
+        self.checkLinks()
+        self.assertEqual(self.server.requests.count(('GET', '/venue.png')), 1)
+        client = fyyur.app.test_client()
+        response = client.get('/images/tile', query_string={'url': self.base + '/venue.png'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        with Image.open(io.BytesIO(response.data)) as image:
+            self.assertEqual(image.size, (400, 300))
+        self.assertEqual(self.server.requests.count(('GET', '/venue.png')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine
+
+from routing import ReplicaRouter, RoutingSession
+
+
+class ReplicaRouterTest(unittest.TestCase):
+    """Two SQLite files stand in for the primary and a replica; each holds
+    a marker row naming its role, so a read shows which engine served it."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = 'sqlite:///' + os.path.join(directory, 'primary.db')
+        replica = 'sqlite:///' + os.path.join(directory, 'replica.db')
+        for url, role in ((primary, 'primary'), (replica, 'replica')):
+            engine = create_engine(url)
+            with engine.begin() as connection:
+                connection.exec_driver_sql('CREATE TABLE marker (id INTEGER PRIMARY KEY, role TEXT)')
+                connection.exec_driver_sql("INSERT INTO marker (role) VALUES ('%s')" % role)
+            engine.dispose()
+
+        app = Flask(__name__)
+        app.config.update(SQLALCHEMY_DATABASE_URI=primary, DATABASE_REPLICA_URLS=[replica],
+                          REPLICA_STICKY_SECONDS=5)
+        db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+        self.last_write = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+        ReplicaRouter(app, read_endpoints=('search',), last_write=lambda: self.last_write)
+
+        def role():
+            return db.session.execute(db.text('SELECT role FROM marker ORDER BY id')).scalar()
+
+        @app.route('/read')
+        def read():
+            return role()
+
+        @app.route('/search', methods=['POST'])
+        def search():
+            return role()
+
+        @app.route('/write', methods=['POST'])
+        def write():
+            db.session.execute(db.text("INSERT INTO marker (role) VALUES ('written')"))
+            db.session.commit()
+            return role()
+
+        self.app = app
+        self.db = db
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            self.db.session.remove()
+            self.db.engine.dispose()
+        for engine in self.app.extensions['replica_router'].engines:
+            engine.dispose()
+
+    def read(self, method='GET', path='/read'):
+        return self.client.open(path, method=method).get_data(as_text=True)
+
+    def test_get_and_search_read_the_replica(self):
+        self.assertEqual(self.read(), 'replica')
+        self.assertEqual(self.read('POST', '/search'), 'replica')
+
+    def test_writes_use_the_primary(self):
+        self.assertEqual(self.read('POST', '/write'), 'primary')
+
+    def test_cookie_pins_reads_after_a_write(self):
+        self.read('POST', '/write')
+        self.assertEqual(self.read(), 'primary')
+        self.assertEqual(self.read('POST', '/search'), 'primary')
+        self.client.delete_cookie(ReplicaRouter.cookie_name)
+        self.assertEqual(self.read(), 'replica')
+
+    def test_recent_write_pins_every_client(self):
+        now = 1000000.0
+        self.last_write = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+        with mock.patch('routing.time.time', return_value=now + 1):
+            self.assertEqual(self.read(), 'primary')
+        with mock.patch('routing.time.time', return_value=now + 6):
+            self.assertEqual(self.read(), 'replica')
+
+
+if __name__ == '__main__':
+    unittest.main()
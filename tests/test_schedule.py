@@ -0,0 +1,145 @@
+import datetime
+import random
+import unittest
+from unittest import mock
+
+from sqlalchemy.exc import IntegrityError
+
+from support import fyyur, loadCatalog
+
+from schedule import IntervalIndex, show_end
+
+
+class IntervalIndexTest(unittest.TestCase):
+
+    def test_half_open_intervals(self):
+        index = IntervalIndex()
+        index.add(1, 10, 20)
+        self.assertEqual(index.overlapping(20, 30), [])
+        self.assertEqual(index.overlapping(0, 10), [])
+        self.assertEqual(index.overlapping(19, 21), [1])
+        self.assertEqual(index.overlapping(12, 14), [1])
+
+    def test_reports_every_show_of_a_merged_block(self):
+        index = IntervalIndex()
+        index.add(1, 10, 20)
+        index.add(2, 15, 25)
+        index.add(3, 40, 50)
+        self.assertEqual(len(index.blocks), 2)
+        self.assertEqual(index.overlapping(18, 30), [1, 2])
+        self.assertEqual(index.overlapping(22, 30), [2])
+        self.assertEqual(index.overlapping(0, 100, ignore=2), [1, 3])
+
+    def test_remove_splits_a_block(self):
+        index = IntervalIndex()
+        index.add(1, 10, 20)
+        index.add(2, 15, 35)
+        index.add(3, 30, 40)
+        index.remove(2)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.overlapping(21, 29), [])
+        self.assertEqual(index.overlapping(0, 100), [1, 3])
+
+    def test_add_moves_an_existing_show(self):
+        index = IntervalIndex()
+        index.add(1, 10, 20)
+        index.add(1, 50, 60)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.overlapping(10, 20), [])
+        self.assertEqual(index.overlapping(55, 56), [1])
+
+    def test_matches_brute_force(self):
+        rnd = random.Random(7)
+        index = IntervalIndex()
+        live = {}
+        for step in range(3000):
+            if live and rnd.random() < 0.3:
+                show_id = rnd.choice(list(live))
+                index.remove(show_id)
+                del live[show_id]
+            else:
+                start = rnd.randint(0, 1000)
+                live[step] = (start, start + rnd.randint(1, 50))
+                index.add(step, *live[step])
+            start = rnd.randint(0, 1000)
+            end = start + rnd.randint(1, 50)
+            expected = {show_id for show_id, (lower, upper) in live.items()
+                        if lower < end and start < upper}
+            self.assertEqual(set(index.overlapping(start, end)), expected)
+
+    def test_datetime_bookings(self):
+        start = datetime.datetime(2030, 1, 1, 20, 0)
+        index = IntervalIndex()
+        index.add(1, start, show_end(start, 120))
+        later = start + datetime.timedelta(minutes=90)
+        self.assertEqual(index.overlapping(later, show_end(later, 60)), [1])
+        self.assertEqual(index.overlapping(show_end(start, 120), show_end(start, 180)), [])
+
+
+class ScheduleCheckerTest(unittest.TestCase):
+
+    start = datetime.datetime(2040, 6, 1, 20, 0)
+
+    def setUp(self):
+        self.context = fyyur.app.app_context()
+        self.context.push()
+        loadCatalog(venues=3, artists=3, shows=0)
+        self.db = fyyur.db
+        self.schedule = fyyur.schedule
+
+    def tearDown(self):
+        self.db.session.remove()
+        self.context.pop()
+
+    def book(self, venue_id, start, artist_id=1):
+        show = fyyur.Show(venue_id=venue_id, artist_id=artist_id, start_time=start, duration=120)
+        self.db.session.add(show)
+        self.db.session.commit()
+        return show.id
+
+    def conflicts(self, venue_id, start):
+        return self.schedule.conflicts(venue_id, start, show_end(start, 60))
+
+    def test_committed_bookings_conflict(self):
+        self.assertEqual(self.conflicts(1, self.start), [])
+        show_id = self.book(1, self.start)
+        self.assertEqual(self.conflicts(1, self.start + datetime.timedelta(minutes=30)), [show_id])
+        self.assertEqual(self.conflicts(2, self.start), [])
+
+    def test_rolled_back_booking_does_not_block(self):
+        self.conflicts(1, self.start)
+        self.db.session.add(fyyur.Show(venue_id=1, artist_id=1, start_time=self.start, duration=120))
+        self.db.session.flush()
+        self.db.session.rollback()
+        self.assertEqual(self.conflicts(1, self.start), [])
+
+    def test_moving_a_show_updates_both_venues(self):
+        show_id = self.book(1, self.start)
+        self.conflicts(1, self.start)
+        self.conflicts(2, self.start)
+        show = self.db.session.get(fyyur.Show, show_id)
+        show.venue_id = 2
+        self.db.session.commit()
+        self.assertEqual(self.conflicts(1, self.start), [])
+        self.assertEqual(self.conflicts(2, self.start), [show_id])
+
+    def test_new_show_touches_no_other_index(self):
+        for venue_id in (1, 2, 3):
+            self.conflicts(venue_id, self.start)
+        with mock.patch.object(IntervalIndex, 'remove') as remove:
+            self.book(1, self.start)
+        remove.assert_not_called()
+
+    def test_form_reports_a_booking_rejected_at_commit(self):
+        client = fyyur.app.test_client()
+        form = {'venue_id': 1, 'artist_id': 1, 'start_time': self.start.isoformat()}
+        with mock.patch.object(self.schedule, 'conflicts', return_value=[]), \
+                mock.patch.object(fyyur.RoutingSession, 'commit',
+                                  side_effect=IntegrityError('INSERT', {}, Exception('overlap'))):
+            response = client.post('/shows/create', data=form)
+        self.assertIn(b'in the meantime', response.data)
+        self.assertEqual(self.db.session.query(fyyur.Show).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+from support import fyyur, loadCatalog
+
+from search import TrigramIndex, normalize
+
+
+class TrigramIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.add(1, 'The Musical Hop San Francisco CA Jazz')
+        self.index.add(2, 'Park Square Live Music & Coffee San Francisco CA')
+        self.index.add(3, 'The Dueling Pianos Bar New York NY')
+
+    def test_normalize(self):
+        self.assertEqual(normalize('  Rock & Roll!  '), 'rock roll')
+        self.assertEqual(normalize(None), '')
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.index.search('music san'), [1, 2])
+        self.assertEqual(self.index.search('music new'), [])
+
+    def test_case_insensitive_substring(self):
+        self.assertEqual(self.index.search('HOP'), [1])
+        self.assertEqual(self.index.search('ueli'), [3])
+
+    def test_ranks_earlier_matches_first(self):
+        self.index.add(4, 'Music Hall')
+        self.assertEqual(self.index.search('music'), [4, 1, 2])
+
+    def test_short_and_empty_terms(self):
+        self.assertEqual(self.index.search('ny'), [3])
+        self.assertEqual(sorted(self.index.search('')), [1, 2, 3])
+
+    def test_update_and_remove(self):
+        self.index.add(1, 'Renamed Venue')
+        self.assertEqual(self.index.search('hop'), [])
+        self.assertEqual(self.index.search('renamed'), [1])
+        self.index.remove(1)
+        self.index.remove(1)
+        self.assertEqual(self.index.search('renamed'), [])
+        self.assertNotIn('ren', self.index.postings)
+
+
+class SearchPagingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with fyyur.app.app_context():
+            loadCatalog(venues=30, artists=5, shows=10)
+
+    def search(self, **form):
+        client = fyyur.app.test_client()
+        with mock.patch.object(fyyur.venue_search, 'search',
+                               wraps=fyyur.venue_search.search) as search:
+            response = client.post('/venues/search', data=dict(search_term='venue', **form))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"venue": 30', response.data)
+        return search.call_args.args[1:3]
+
+    def test_default_page(self):
+        self.assertEqual(self.search(), (fyyur.SEARCH_PAGE_SIZE, 0))
+
+    def test_negative_limit_and_offset_are_clamped(self):
+        self.assertEqual(self.search(limit=-1, offset=-5), (1, 0))
+
+    def test_oversized_limit_is_capped(self):
+        self.assertEqual(self.search(limit=10 ** 9), (fyyur.SEARCH_PAGE_MAX, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from support import fyyur, loadCatalog
+
+
+class RefreshSummariesTest(unittest.TestCase):
+
+    def setUp(self):
+        with fyyur.app.app_context():
+            loadCatalog(venues=5, artists=5, shows=20)
+        self.runner = fyyur.app.test_cli_runner()
+
+    def version(self):
+        with fyyur.app.app_context():
+            return fyyur.data_version.read()[0]
+
+    def test_rebuild_moves_the_data_version(self):
+        before = self.version()
+        result = self.runner.invoke(args=['refresh-summaries', '--full'])
+        self.assertIn('Inserted 20 and deleted 20 show summaries', result.output)
+        self.assertEqual(self.version(), before + 1)
+        self.assertIsNone(self.runner.invoke(args=['check-summaries']).exception)
+
+    def test_nothing_to_refresh_keeps_the_version(self):
+        before = self.version()
+        result = self.runner.invoke(args=['refresh-summaries'])
+        self.assertIn('Inserted 0 and deleted 0 show summaries', result.output)
+        self.assertEqual(self.version(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask
+
+from tasks import Job, SQLiteStore, TaskQueue
+
+
+class SQLiteStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SQLiteStore(os.path.join(self.directory, 'tasks.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_claim_takes_each_job_once(self):
+        self.store.put(Job('ping', [1], {}))
+        job = self.store.claim(timeout=0)
+        self.assertEqual((job.name, job.args, job.attempts), ('ping', [1], 0))
+        self.assertIsNone(self.store.claim(timeout=0))
+        self.assertEqual(self.store.stats()['running'], 1)
+        self.store.done(job)
+        self.assertEqual(self.store.stats()['running'], 0)
+
+    def test_claim_waits_for_run_at(self):
+        self.store.put(Job('later', [], {}, run_at=time.time() + 60))
+        self.store.put(Job('now', [], {}))
+        self.assertEqual(self.store.claim(timeout=0).name, 'now')
+        self.assertIsNone(self.store.claim(timeout=0))
+
+    def test_retry_requeues_with_attempts(self):
+        self.store.put(Job('flaky', [], {}))
+        job = self.store.claim(timeout=0)
+        job.attempts = 1
+        job.run_at = time.time() + 60
+        self.store.retry(job, 'boom')
+        self.assertIsNone(self.store.claim(timeout=0))
+        self.assertEqual(self.store.stats()['queued'], 1)
+
+        job.run_at = time.time() - 1
+        self.store.retry(job, 'boom')
+        again = self.store.claim(timeout=0)
+        self.assertEqual((again.id, again.attempts), (job.id, 1))
+
+    def test_fail_and_requeue_stale(self):
+        self.store.put(Job('broken', [], {}))
+        self.store.put(Job('abandoned', [], {}))
+        self.store.fail(self.store.claim(timeout=0), 'boom')
+        self.store.claim(timeout=0)
+        self.assertEqual(self.store.requeue_stale(60), 0)
+        self.assertEqual(self.store.requeue_stale(-1), 1)
+        self.assertEqual(self.store.stats(), {'store': 'sqlite', 'queued': 1, 'running': 0,
+                                              'failed': 1})
+
+    def test_concurrent_claims_never_share_a_job(self):
+        for number in range(60):
+            self.store.put(Job('job', [number], {}))
+        claimed = []
+        lock = threading.Lock()
+
+        def drain():
+            while True:
+                job = self.store.claim(timeout=0)
+                if job is None:
+                    return
+                with lock:
+                    claimed.append(job.id)
+
+        threads = [threading.Thread(target=drain) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), sorted(set(claimed)))
+        self.assertEqual(len(claimed), 60)
+
+
+class TaskQueueRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        app = Flask(__name__)
+        app.config.update(TASK_QUEUE='sqlite', TASK_WORKERS=0, TASK_MAX_ATTEMPTS=2,
+                          TASK_QUEUE_PATH=os.path.join(self.directory, 'tasks.db'))
+        self.queue = TaskQueue(app)
+        self.calls = 0
+
+        @self.queue.task
+        def flaky():
+            self.calls += 1
+            raise OSError('unreachable')
+
+        self.flaky = flaky
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_failing_job_is_retried_then_failed(self):
+        self.flaky.delay()
+        job = self.queue.store.claim(timeout=0)
+        self.assertFalse(self.queue.run(job))
+        self.assertEqual(self.queue.counts['retried'], 1)
+        self.assertGreater(job.run_at, time.time())
+        self.assertIsNone(self.queue.store.claim(timeout=0))
+
+        job.run_at = time.time() - 1
+        self.queue.store.retry(job, 'OSError: unreachable')
+        job = self.queue.store.claim(timeout=0)
+        self.assertEqual(job.attempts, 1)
+        self.assertFalse(self.queue.run(job))
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.queue.store.stats()['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import datetime
+import unittest
+
+from support import fyyur, loadCatalog
+
+
+class TourTest(unittest.TestCase):
+
+    def setUp(self):
+        with fyyur.app.app_context():
+            loadCatalog(venues=3, artists=2, shows=0)
+        self.client = fyyur.app.test_client()
+
+    def submit(self, *lines):
+        response = self.client.post('/shows/create-batch', data={'shows': '\n'.join(lines)})
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
+    def count(self):
+        with fyyur.app.app_context():
+            return fyyur.db.session.query(fyyur.Show).count()
+
+    def test_lists_every_show(self):
+        page = self.submit('1, 1, 2040-01-01 20:00', '1, 2, 2040-01-01 22:00',
+                           '2, 1, 2040-01-01 22:00, 60')
+        self.assertIn('3 shows were successfully listed!', page)
+        self.assertEqual(self.count(), 3)
+
+    def test_artist_overlap_within_the_batch(self):
+        page = self.submit('1, 1, 2040-01-01 20:00', '1, 2, 2040-01-01 21:30')
+        self.assertIn('Line 2: artist 1 is already booked by line 1.', page)
+        self.assertEqual(self.count(), 0)
+
+    def test_artist_overlap_with_a_stored_show(self):
+        self.submit('1, 1, 2040-01-01 20:00')
+        page = self.submit('1, 2, 2040-01-01 20:30')
+        self.assertIn('Line 1: artist 1 is already booked by show', page)
+        self.assertEqual(self.count(), 1)
+
+    def test_venue_overlap_and_unknown_ids(self):
+        page = self.submit('1, 1, 2040-01-01 20:00', '2, 1, 2040-01-01 21:00', '9, 9, 2040-01-02 20:00')
+        self.assertIn('Line 2: venue 1 is already booked by line 1.', page)
+        self.assertIn('Line 3: venue 9 is not listed.', page)
+        self.assertIn('Line 3: artist 9 is not listed.', page)
+        self.assertEqual(self.count(), 0)
+
+    def test_back_to_back_shows_are_fine(self):
+        start = datetime.datetime(2040, 1, 1, 20, 0)
+        page = self.submit('1, 1, %s' % start, '1, 2, %s' % (start + datetime.timedelta(hours=2)))
+        self.assertIn('2 shows were successfully listed!', page)
+
+    def test_malformed_line(self):
+        page = self.submit('1, 1')
+        self.assertIn('Line 1 is not', page)
+
+
+if __name__ == '__main__':
+    unittest.main()